@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+
+from data import json_backend
+from data.export_zip import AppleHealthExportZip
+
+help_text = """
+Usage:
+
+   $ python benchmark_json_backends.py path/to/apple_health_export ${args}
+
+    Measures decode and encode throughput of each available JSON backend
+    (orjson, msgspec, stdlib json) on the clinical-records files of an export
+    directory or export.zip. Encoding uses observations.json from the export
+    directory if present, written with the same indent as the report, and
+    otherwise the decoded clinical records.
+
+    --repeat=[int]
+        Number of timed passes per backend, the fastest of which is reported.
+        Defaults to 3.
+
+    -h, --help
+        Print this help text
+"""
+
+
+def read_clinical_records(export_path: str):
+    if os.path.isfile(export_path):
+        export_zip = AppleHealthExportZip(export_path)
+        files = [export_zip.read_clinical_record(f) for f in export_zip.list_clinical_records()]
+        export_zip.close()
+        return files
+    base_dir = os.path.join(export_path, "clinical-records")
+    files = []
+    for f in sorted(os.listdir(base_dir)):
+        with open(os.path.join(base_dir, f), "rb") as json_file:
+            files.append(json_file.read())
+    return files
+
+
+def time_best(function, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def print_result(operation: str, backend: str, total_bytes: int, elapsed: float, note=""):
+    throughput = total_bytes / elapsed / (1 << 20)
+    print(f"{operation:<8}{backend:<10}{elapsed * 1000:>10.1f} ms{throughput:>10.1f} MB/s  {note}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ["-h", "--help"]:
+        print(help_text)
+        exit()
+
+    export_path = sys.argv[1]
+    repeat = 3
+    for arg in sys.argv[2:]:
+        if arg.startswith("--repeat="):
+            try:
+                repeat = int(arg[len("--repeat="):])
+                if repeat < 1:
+                    raise ValueError("Repeat must be at least 1")
+            except Exception:
+                print(f"\"{arg}\" is not a valid number of passes.")
+                exit(1)
+        else:
+            print(f"Unrecognized option \"{arg}\"")
+            print(help_text)
+            exit(1)
+    if not os.path.exists(export_path):
+        print("Apple Health data export path \"" + export_path + "\" is invalid.")
+        exit(1)
+
+    files = read_clinical_records(export_path)
+    total_bytes = sum(len(f) for f in files)
+    print(f"Decoding {len(files)} clinical-records files ({total_bytes / (1 << 20):.1f} MB)")
+    for backend in json_backend.DECODE_BACKENDS:
+        elapsed = time_best(lambda: [json_backend.loads(f, backend) for f in files], repeat)
+        print_result("decode", backend, total_bytes, elapsed)
+
+    observations_json_path = os.path.join(
+        os.path.dirname(export_path) if os.path.isfile(export_path) else export_path, "observations.json")
+    if os.path.exists(observations_json_path):
+        encode_data = json_backend.load(observations_json_path)
+        indent = 4
+    else:
+        encode_data = [json_backend.loads(f) for f in files]
+        indent = 2
+    expected = json_backend.dumps(encode_data, indent=indent, backend="json")
+    encoded_bytes = len(expected.encode("utf-8"))
+    print(f"Encoding {encoded_bytes / (1 << 20):.1f} MB with indent={indent}")
+    for backend in json_backend.ENCODE_BACKENDS:
+        elapsed = time_best(lambda: json_backend.dumps(encode_data, indent=indent, backend=backend), repeat)
+        matches = json_backend.dumps(encode_data, indent=indent, backend=backend) == expected
+        print_result("encode", backend, encoded_bytes, elapsed,
+                     "" if matches else "(output differs from stdlib json)")
@@ -0,0 +1,154 @@
+import sys
+import time
+import tracemalloc
+
+from data.export_zip import AppleHealthExportZip
+from data.observation_json_parser import ObservationJSONDataParser
+from parse_data import HealthDataParseArgs
+
+help_text = """
+Usage:
+
+   $ python benchmark_observation_memory.py path/to/apple_health_export ${args}
+
+    Measures the memory held by the observations parsed from the
+    clinical-records files of an export directory or export.zip, and compares
+    the slotted Observation, Result and LabTest objects and their interned
+    category, date, unit and reference range strings against the same objects
+    each holding an instance dict and their own copy of every string.
+
+    --workers=[int]
+        Number of processes used to decode the clinical-records files, as
+        for parse_data.py. Defaults to 1.
+
+    -h, --help
+        Print this help text
+"""
+
+INTERNED_FIELDS = {"Observation": ["category", "date", "unit"],
+                   "Result": ["range_text"],
+                   "LabTest": ["test_desc", "primary_id"]}
+
+
+def format_size(size: int):
+    if size >= 1 << 20:
+        return f"{size / (1 << 20):.2f} MB"
+    return f"{size / (1 << 10):.1f} KB"
+
+
+def get_slots(cls):
+    slots = []
+    for base in reversed(cls.__mro__):
+        slots += list(base.__dict__.get("__slots__", ()))
+    return slots
+
+
+def parse_observations(args):
+    export_zip = AppleHealthExportZip(args.export_zip) if args.export_zip is not None else None
+    parser = ObservationJSONDataParser(args, [], None, export_zip)
+    tracemalloc.start()
+    start = time.perf_counter()
+    observations_data = parser.parse()
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if export_zip is not None:
+        export_zip.close()
+    return observations_data, elapsed, retained, peak
+
+
+def get_parsed_objects(observations_data):
+    objects = {"Observation": [], "Result": [], "LabTest": []}
+    seen_tests = set()
+    for obs in observations_data.observations.values():
+        objects["Observation"].append(obs)
+        if obs.result is not None:
+            objects["Result"].append(obs.result)
+        if id(obs.test) not in seen_tests:
+            seen_tests.add(id(obs.test))
+            objects["LabTest"].append(obs.test)
+    return objects
+
+
+def measure_dict_layout(instances: list):
+    # Copies of the instances with the same attributes held in an instance
+    # dict, set in slot order as an unslotted __init__ would
+    if len(instances) == 0:
+        return 0
+    dict_class = type(type(instances[0]).__name__ + "Dict", (), {})
+    slots = get_slots(type(instances[0]))
+    tracemalloc.start()
+    copies = [None] * len(instances)
+    before = tracemalloc.get_traced_memory()[0]
+    for i, instance in enumerate(instances):
+        copy = dict_class()
+        for name in slots:
+            if hasattr(instance, name):
+                setattr(copy, name, getattr(instance, name))
+        copies[i] = copy
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size
+
+
+def measure_strings(instances: list, fields: list):
+    references = 0
+    total_size = 0
+    distinct = {}
+    for instance in instances:
+        for name in fields:
+            value = getattr(instance, name, None)
+            if type(value) == str:
+                references += 1
+                total_size += sys.getsizeof(value)
+                distinct[id(value)] = sys.getsizeof(value)
+    return references, len(distinct), total_size, sum(distinct.values())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ["-h", "--help"]:
+        print(help_text)
+        exit()
+
+    args = HealthDataParseArgs(sys.argv[1])
+    for arg in sys.argv[2:]:
+        if arg.startswith("--workers="):
+            try:
+                args.workers = int(arg[len("--workers="):])
+                if args.workers < 1:
+                    raise ValueError("Workers must be at least 1")
+            except Exception:
+                print(f"\"{arg}\" is not a valid number of workers.")
+                exit(1)
+        else:
+            print(f"Unrecognized option \"{arg}\"")
+            print(help_text)
+            exit(1)
+
+    observations_data, elapsed, retained, peak = parse_observations(args)
+    objects = get_parsed_objects(observations_data)
+    count = len(objects["Observation"])
+    print(f"Parsed {count} observations in {elapsed:.2f} s")
+    print(f"Retained {format_size(retained)} ({retained / max(count, 1):.0f} bytes per observation), "
+          + f"peak {format_size(peak)}")
+
+    print()
+    print(f"{'Objects':<14}{'Count':>10}{'Slotted':>14}{'With dict':>14}{'Saved':>14}")
+    total_saved = 0
+    for name, instances in objects.items():
+        slotted = sum(sys.getsizeof(instance) for instance in instances)
+        with_dict = measure_dict_layout(instances)
+        total_saved += with_dict - slotted
+        print(f"{name:<14}{len(instances):>10}{format_size(slotted):>14}"
+              + f"{format_size(with_dict):>14}{format_size(with_dict - slotted):>14}")
+
+    print()
+    print(f"{'Strings':<14}{'References':>12}{'Distinct':>10}{'Interned':>14}{'Copied':>14}{'Saved':>14}")
+    for name, instances in objects.items():
+        references, distinct, total_size, distinct_size = measure_strings(instances, INTERNED_FIELDS[name])
+        total_saved += total_size - distinct_size
+        print(f"{name:<14}{references:>12}{distinct:>10}{format_size(distinct_size):>14}"
+              + f"{format_size(total_size):>14}{format_size(total_size - distinct_size):>14}")
+
+    print()
+    print(f"Saved {format_size(total_saved)} in total")
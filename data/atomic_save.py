@@ -0,0 +1,20 @@
+import os
+
+
+def save_atomic(path: str, write_fn, description: str, verbose=False, temp_suffix=".tmp"):
+    '''
+    Calls write_fn with a temporary path next to path and moves the file
+    written there into place, so an interrupted run leaves no partial file.
+    Failures print a warning naming the description rather than stopping the
+    run. Returns whether the file was saved.
+    '''
+    temp_path = path + temp_suffix
+    try:
+        write_fn(temp_path)
+        os.replace(temp_path, path)
+        return True
+    except Exception as e:
+        print("WARNING: Failed to save " + description)
+        if verbose:
+            print(e)
+        return False
@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+from data.atomic_save import save_atomic
+from data import json_backend
+
+CLINICAL_RECORDS_MANIFEST_VERSION = 3
+
+
+def get_bytes_hash(file_bytes: bytes):
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+
+class ClinicalRecordsManifest:
+    '''
+    Records the name, size, modification stamp and content hash of each
+    clinical-records file parsed along with the record decoded from it, so a
+    later run over a cumulative export decodes only the files that are new or
+    changed. Files with an unchanged size and stamp are not read at all, and
+    the others are only decoded if their content hash has changed. Records
+    hold the filtered observations as read from the file rather than parsed
+    Observations, which depend on the files parsed before them and on the
+    parse options, so observations are always built fresh in file order and
+    the output matches a full parse. The manifest is saved as JSON, since
+    the records are only ever data decoded from JSON, so loading a manifest
+    from a shared export directory can't run code.
+    '''
+    def __init__(self, manifest_path: str, args):
+        self.manifest_path = manifest_path
+        self.verbose = args.verbose
+        self.entries = {}
+        self.seen_entries = {}
+        self.reused_files = set()
+
+    def load(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            manifest = json_backend.load(self.manifest_path)
+            if manifest["version"] != CLINICAL_RECORDS_MANIFEST_VERSION:
+                if self.verbose:
+                    print("Clinical records manifest is out of date, decoding all files")
+                return
+            self.entries = manifest["files"]
+        except Exception as e:
+            print("WARNING: Failed to load clinical records manifest, decoding all files")
+            if self.verbose:
+                print(e)
+
+    def find_record(self, f: str, size: int, modified):
+        # The record saved for the file if its size and modification stamp
+        # are unchanged, otherwise None, without reading the file
+        saved_entry = self.entries.get(f)
+        if (saved_entry is None or saved_entry["size"] != size
+                or saved_entry["modified"] != modified):
+            return None
+        self.seen_entries[f] = saved_entry
+        self.reused_files.add(f)
+        return saved_entry["record"]
+
+    def match_record(self, f: str, size: int, modified, file_bytes: bytes):
+        # For a file whose stamp changed, the record saved for the file if its
+        # content is unchanged, otherwise None. Either way the file's stamp and
+        # hash are kept for set_record.
+        entry = {"size": size, "modified": modified, "hash": get_bytes_hash(file_bytes), "record": None}
+        self.seen_entries[f] = entry
+        saved_entry = self.entries.get(f)
+        if saved_entry is None or saved_entry["hash"] != entry["hash"]:
+            return None
+        entry["record"] = saved_entry["record"]
+        self.reused_files.add(f)
+        return entry["record"]
+
+    def set_record(self, f: str, record: dict):
+        self.seen_entries[f]["record"] = record
+
+    def save(self):
+        # Files no longer in the export are dropped
+        manifest = {"version": CLINICAL_RECORDS_MANIFEST_VERSION, "files": self.seen_entries}
+        saved = save_atomic(self.manifest_path, lambda path: json_backend.dump(manifest, path),
+                            "clinical records manifest", self.verbose)
+        if saved and self.verbose:
+            print(f"Saved clinical records manifest of {len(self.seen_entries)} files to "
+                  + self.manifest_path)
@@ -1,14 +1,19 @@
 from datetime import datetime, timezone
-import operator
 import os
 import traceback
 
+from data.clinical_records_manifest import ClinicalRecordsManifest
+from data.export_zip import AppleHealthExportZip
 from data.observation_json_parser import ObservationsData, ObservationJSONDataParser
+from data.observation_store import ObservationStore, OBSERVATION_STORE_FILENAME
+from data.parse_snapshot import ParseSnapshot
+from data.xml_cache import XMLParseCache
 from data.xml_parser import AppleHealthXMLData, AppleHealthXMLParser
 from data.food_data import FoodData
 from data.symptom_set import SymptomSet
 from data.units import VitalSignCategory, HeightUnit, WeightUnit, TemperatureUnit
-from data.units import convert, calculate_bmi, set_stats
+from data.timestamp_parser import get_epoch
+from data.units import convert, calculate_bmi, get_stdev, set_stats
 from generate_diagnostic_report_files import generate_diagnostic_report_files
 from reporting.graph import VitalsStatsGraph
 from reporting.reporter import Reporter
@@ -38,9 +43,17 @@ class DataParser:
         self.abnormal_results_by_code_text = os.path.join(self.data_export_dir, "abnormal_results_by_code.txt")
         self.export_xml = os.path.join(self.data_export_dir, "export.xml")
         self.export_cda_xml = os.path.join(self.data_export_dir, "export_cda.xml")
+        self.export_xml_cache = os.path.join(self.data_export_dir, "export_xml_cache.npz")
+        self.parse_snapshot = os.path.join(self.data_export_dir, "parse_snapshot.json")
+        self.clinical_records_manifest = os.path.join(self.data_export_dir, "clinical_records_manifest.json")
+        self.observation_store = os.path.join(self.data_export_dir, OBSERVATION_STORE_FILENAME)
         self.base_dir = os.path.join(self.data_export_dir, "clinical-records")
+        self.export_zip = None
+        if args.export_zip is not None:
+            self.export_zip = AppleHealthExportZip(args.export_zip)
 
-        self.xml_data = AppleHealthXMLData(self.normal_height_unit, self.normal_weight_unit)
+        self.xml_data = AppleHealthXMLData(self.normal_height_unit, self.normal_weight_unit,
+                                           args.aggregates_only)
         self.custom_data_files = []
         self.food_data = None
         self.symptom_data = None
@@ -53,8 +66,21 @@ class DataParser:
 
     def run(self):
         self.process_custom_data()
-        self.process_xml_data()
-        self.process_json_data()
+        if self.args.reclassify:
+            self.load_parse_snapshot()
+        else:
+            self.process_xml_data()
+            self.process_json_data()
+            if self.args.parse_snapshot:
+                self.save_parse_snapshot()
+        store = None
+        if self.args.observation_store:
+            try:
+                store = ObservationStore(self.observation_store, self.verbose)
+            except Exception as e:
+                print(e)
+                exit(1)
+            self.observations_data = store.update(self.observations_data, self.args)
         self.observations_data.determine_abnormal_results(self.verbose,
                 self.args.skip_in_range_abnormal_results,
                 self.args.in_range_abnormal_boundary)
@@ -62,11 +88,17 @@ class DataParser:
         self.do_stats_calcs()
         self.create_wearable_vitals_graph(self.xml_data)
         self.report()
+        if store is not None:
+            store.mark_reported()
+            store.close()
 
     def process_custom_data(self):
         ## PROCESS CUSTOM DATA FILES
         if self.args.extra_observations_csv is not None:
             self.custom_data_files.append(self.args.extra_observations_csv)
+            if self.export_zip is not None and not os.path.exists(self.base_dir):
+                # Custom reports can't be added to the zip, keep them beside it
+                os.makedirs(self.base_dir)
             if not generate_diagnostic_report_files(self.args.extra_observations_csv, self.base_dir, self.verbose, False):
                 exit(1)
 
@@ -112,16 +144,60 @@ class DataParser:
         if self.args.only_clinical_records:
             if self.verbose:
                 print("Skipping all data present not in clinical-records folder.")
-        elif os.path.exists(self.export_xml):
+        elif self.has_export_xml():
+            xml_cache = self.get_xml_cache()
+            if self.args.xml_cache and xml_cache.load(self.xml_data, self.args.subject):
+                return
             xml_parser = AppleHealthXMLParser(self.xml_data, self.args)
-            xml_parser.parse(self.export_xml)
+            xml_parser.parse(self.export_xml, self.export_zip)
+            if self.args.xml_cache:
+                xml_cache.save(self.xml_data, self.args.subject)
         else:
             print("WARNING: export.xml or export_cda.xml not found in export directory.")
 
+    def get_xml_cache(self):
+        # The cache is keyed on the zip itself when reading from one
+        export_file_path = self.args.export_zip if self.export_zip is not None else self.export_xml
+        return XMLParseCache(self.export_xml_cache, export_file_path, self.args)
+
+    def has_export_xml(self):
+        if self.export_zip is not None:
+            return self.export_zip.has_export_xml()
+        return os.path.exists(self.export_xml)
+
     def process_json_data(self):
-        json_parser = ObservationJSONDataParser(self.args, self.custom_data_files, self.observations_data)
+        manifest = None
+        if self.args.clinical_records_cache:
+            manifest = ClinicalRecordsManifest(self.clinical_records_manifest, self.args)
+            manifest.load()
+        json_parser = ObservationJSONDataParser(self.args, self.custom_data_files, self.observations_data,
+                                                self.export_zip, manifest)
         json_parser.parse()
 
+    def save_parse_snapshot(self):
+        # Food and symptom data are read again on each run
+        custom_data_files = [f for f in self.custom_data_files
+                             if f != self.food_data_csv and f != self.symptom_data_csv]
+        snapshot = ParseSnapshot(self.parse_snapshot, self.args)
+        snapshot.save(self.observations_data, self.args.subject, custom_data_files)
+
+    def load_parse_snapshot(self):
+        snapshot = ParseSnapshot(self.parse_snapshot, self.args).load()
+        self.observations_data = snapshot["observationsData"]
+        # The snapshot leaves the vitals from export.xml to the XML parse cache
+        if not self.args.only_clinical_records and self.has_export_xml():
+            if not self.get_xml_cache().load(self.xml_data, self.args.subject):
+                print("The export.xml parse cache " + self.export_xml_cache + " is missing or out of date. "
+                      + "Run without --reclassify to parse again.")
+                exit(1)
+        for key, value in snapshot["subject"].items():
+            if key not in self.args.subject:
+                self.args.subject[key] = value
+        for f in snapshot["customDataFiles"]:
+            if f not in self.custom_data_files:
+                self.custom_data_files.append(f)
+        if self.verbose:
+            print("Reclassified clinical records results with new abnormal result thresholds")
 
     def compile_vital_signs_data(self):
         ## COMPILE VITAL SIGNS DATA
@@ -132,6 +208,8 @@ class DataParser:
         for vitals_date in sorted(self.observations_data.observations_vital_signs.keys()):
             vitals_datetime = datetime.fromisoformat(vitals_date)
             vitals_datetime = vitals_datetime.replace(tzinfo=current_tzinfo)
+            # Normalize to UTC epoch seconds like the XML data so all samples sort together
+            _, vitals_epoch, vitals_offset = get_epoch(vitals_datetime)
             this_date_observations = self.observations_data.observations_vital_signs[vitals_date]
             this_date_height = None
             this_date_height_unit = None
@@ -159,36 +237,35 @@ class DataParser:
                             continue
                     if obs.vital_sign_category is VitalSignCategory.BLOOD_PRESSURE:
                         self.xml_data.blood_pressure_stats["unit"] = obs.unit
-                        set_stats(self.xml_data.blood_pressure_stats, vitals_datetime,
+                        set_stats(self.xml_data.blood_pressure_stats, vitals_epoch, vitals_offset,
                                 [obs.value, obs.value2])
                     elif obs.vital_sign_category is VitalSignCategory.PULSE:
                         self.xml_data.pulse_stats["unit"] = obs.unit
-                        set_stats(self.xml_data.pulse_stats, vitals_datetime, obs.value)
-                        self.xml_data.pulse_stats["list"][-1]["motion"] = 0
                         # Assume heart rate observations in clinical-records are not in motion
+                        set_stats(self.xml_data.pulse_stats, vitals_epoch, vitals_offset, obs.value)
                     elif obs.vital_sign_category is VitalSignCategory.RESPIRATION:
                         self.xml_data.respiration_stats["unit"] = obs.unit
-                        set_stats(self.xml_data.respiration_stats, vitals_datetime, obs.value)
+                        set_stats(self.xml_data.respiration_stats, vitals_epoch, vitals_offset, obs.value)
                     elif obs.vital_sign_category is VitalSignCategory.TEMPERATURE:
                         this_temp_unit = TemperatureUnit.from_value(obs.unit)
                         normalized_temperature = round(this_temp_unit.convertTo(
                             self.args.normal_temperature_unit, obs.value), 2)
-                        set_stats(self.xml_data.temperature_stats, vitals_datetime,
+                        set_stats(self.xml_data.temperature_stats, vitals_epoch, vitals_offset,
                                 normalized_temperature)
                         self.xml_data.temperature_stats["unit"] = obs.unit
                 if this_date_height is not None and this_date_height_unit is not None:
                     normalized_height = convert(self.args.normal_height_unit,
                         HeightUnit.from_value(this_date_height_unit), this_date_height)
-                    set_stats(self.xml_data.height_stats, vitals_datetime, normalized_height)
+                    set_stats(self.xml_data.height_stats, vitals_epoch, vitals_offset, normalized_height)
                 if this_date_weight is not None and this_date_weight_unit is not None:
                     normalized_weight = convert(self.args.normal_weight_unit,
                         WeightUnit.from_value(this_date_weight_unit), this_date_weight)
-                    set_stats(self.xml_data.weight_stats, vitals_datetime, normalized_weight)
+                    set_stats(self.xml_data.weight_stats, vitals_epoch, vitals_offset, normalized_weight)
                 if normalized_height is None or normalized_weight is None:
                     continue
                 bmi = calculate_bmi(normalized_height, normalized_weight,
                                     self.args.normal_height_unit, self.args.normal_weight_unit, self.verbose)
-                set_stats(self.xml_data.bmi_stats, vitals_datetime, bmi)
+                set_stats(self.xml_data.bmi_stats, vitals_epoch, vitals_offset, bmi)
             except Exception as e:
                 if self.verbose:
                     print(e)
@@ -197,48 +274,23 @@ class DataParser:
     def do_stats_calcs(self):
         # TODO refactor this logic into a function in a Stats class
         for stats_obj in self.xml_data.vitals_stats_list:
-            try:
-                stats_obj["list"] = sorted(
-                    stats_obj["list"], key=operator.itemgetter("time"))
-            except Exception:
-                print("WARNING: Encountered a problem comparing timezones between XML and clinical records JSON data."
-                    + " Vital signs output that relies on sorting may not be calculated correctly.")
-                tzinfos = []
-                for obs in stats_obj["list"]:
-                    date = obs["time"]
-                    if date.tzinfo not in tzinfos:
-                        if self.verbose:
-                            print("Found new tzinfo for date " + str(date))
-                            print(date.tzinfo)
-                        tzinfos.append(date.tzinfo)
+            # Samples are held as UTC epoch seconds, so sorting can't fail on mixed timezones
+            stats_obj["list"].sort()
             if stats_obj["count"] > 0:
-                stats_obj["mostRecent"] = stats_obj["list"][-1]
+                stats_obj["mostRecent"] = stats_obj["list"].get_most_recent()
                 if stats_obj["mostRecent"]["value"] is None:
                     if self.verbose:
                         print("Stats collection for vital " + str(stats_obj["vital"]) + " failed.")
-                elif type(stats_obj["mostRecent"]["value"]) == list:
-                    stats_obj["stDev"] = []
-                    for i in range(len(stats_obj["mostRecent"])):
-                        avg = stats_obj["sum"][i] / stats_obj["count"]
-                        stats_obj["avg"][i] = avg
-                        sum_sq_diffs = 0
-                        for obs in stats_obj["list"]:
-                            sum_sq_diffs += (obs["value"][i] - avg) ** 2
-                        stats_obj["stDev"].append(
-                            (sum_sq_diffs / stats_obj["count"]) ** (1/2))
-                    del stats_obj["sum"]
                 else:
-                    avg = stats_obj["sum"] / stats_obj["count"]
-                    stats_obj["avg"] = avg
-                    del stats_obj["sum"]
-                    sum_sq_diffs = 0
-                    for obs in stats_obj["list"]:
-                        sum_sq_diffs += (obs["value"] - avg) ** 2
-                    stats_obj["stDev"] = (sum_sq_diffs / stats_obj["count"]) ** (1/2)
+                    stats_obj["stDev"] = get_stdev(stats_obj)
                 if self.verbose:
                     print("Found stats for vital sign: " + stats_obj["vital"])
                     print(str(stats_obj["count"]) + " unique observations with average value "
                         + str(stats_obj["avg"]) + " and standard deviation " + str(stats_obj["stDev"]))
+            else:
+                # Vitals without samples are still written with a zero sum
+                stats_obj["sum"] = [0] * len(stats_obj["m2"]) if type(stats_obj["m2"]) == list else 0
+            del stats_obj["m2"]
 
 
     def create_wearable_vitals_graph(self, data):
@@ -249,7 +301,7 @@ class DataParser:
         if data.pulse_stats["graphEligible"]:
             try:
                 self.vital_stats_graph = VitalsStatsGraph(
-                    AppleHealthXMLParser.min_xml_ordinal, data.pulse_stats, data.hrv_stats, data.step_stats, data.stand_stats)
+                    data.min_xml_ordinal, data.pulse_stats, data.hrv_stats, data.step_stats, data.stand_stats)
                 self.vital_stats_graph.save_graph_images(self.data_export_dir)
             except Exception as e:
                 if self.verbose:
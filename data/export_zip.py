@@ -0,0 +1,68 @@
+import posixpath
+import zipfile
+
+from data import json_backend
+
+EXPORT_XML_FILENAME = "export.xml"
+CLINICAL_RECORDS_DIRNAME = "clinical-records"
+
+
+class AppleHealthExportZip:
+    '''
+    Reads an Apple Health export.zip in place. The archive normally holds a
+    single apple_health_export folder, but members are located by name so a
+    zip of the export folder contents works as well. export.xml is opened as
+    a stream and clinical-records JSON files are decoded straight from their
+    members, so nothing is extracted to disk.
+    '''
+    def __init__(self, export_zip_file_path):
+        self.export_zip_file_path = export_zip_file_path
+        self.zip_file = zipfile.ZipFile(export_zip_file_path)
+        self.export_xml_member = None
+        self.clinical_records_members = {}
+        for name in self.zip_file.namelist():
+            if name.endswith("/"):
+                continue
+            dirname, filename = posixpath.split(name)
+            if filename == EXPORT_XML_FILENAME:
+                # Prefer the top-most export.xml if the archive holds more than one
+                if (self.export_xml_member is None
+                        or name.count("/") < self.export_xml_member.count("/")):
+                    self.export_xml_member = name
+            elif posixpath.basename(dirname) == CLINICAL_RECORDS_DIRNAME and filename.endswith(".json"):
+                self.clinical_records_members[filename] = name
+
+    def has_export_xml(self):
+        return self.export_xml_member is not None
+
+    def has_clinical_records(self):
+        return len(self.clinical_records_members) > 0
+
+    def open_export_xml(self):
+        return self.zip_file.open(self.export_xml_member)
+
+    def list_clinical_records(self):
+        return list(self.clinical_records_members.keys())
+
+    def get_clinical_record_path(self, filename):
+        return self.export_zip_file_path + ":" + self.clinical_records_members[filename]
+
+    def load_clinical_record(self, filename):
+        return json_backend.loads(self.read_clinical_record(filename))
+
+    def read_clinical_record(self, filename):
+        return self.zip_file.read(self.clinical_records_members[filename])
+
+    def open_clinical_record(self, filename):
+        return self.zip_file.open(self.clinical_records_members[filename])
+
+    def get_clinical_record_stat(self, filename):
+        # Size and CRC from the central directory, which change with the content
+        info = self.zip_file.getinfo(self.clinical_records_members[filename])
+        return info.file_size, info.CRC
+
+    def get_clinical_record_size(self, filename):
+        return self.zip_file.getinfo(self.clinical_records_members[filename]).file_size
+
+    def close(self):
+        self.zip_file.close()
@@ -0,0 +1,105 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# In order of preference. msgspec always encodes datetimes itself rather than
+# passing them to a default function, so it is only used for decoding.
+DECODE_BACKENDS = [name for name, module in [("orjson", orjson), ("msgspec", msgspec)]
+                   if module is not None] + ["json"]
+ENCODE_BACKENDS = (["orjson"] if orjson is not None else []) + ["json"]
+
+INDENT = b"  "
+
+
+def get_decode_backend():
+    return DECODE_BACKENDS[0]
+
+
+def get_encode_backend(indent=None):
+    # orjson only indents by two spaces, widened afterwards for even indents,
+    # and its compact output omits the spaces json.dumps puts after separators
+    if indent is None or indent % 2 != 0:
+        return "json"
+    return ENCODE_BACKENDS[0]
+
+
+def widen_indent(encoded: bytes, indent: int):
+    # orjson escapes tabs and newlines in strings, so a newline followed by
+    # spaces is always indentation. Levels are swapped for tabs deepest first
+    # so shallower levels cannot match inside them, then the tabs are widened.
+    depth = 0
+    while b"\n" + INDENT * (depth + 1) in encoded:
+        depth += 1
+    for level in range(depth, 0, -1):
+        encoded = encoded.replace(b"\n" + INDENT * level, b"\n" + b"\t" * level)
+    return encoded.replace(b"\t", b" " * indent)
+
+
+def loads(data, backend=None):
+    backend = backend if backend is not None else get_decode_backend()
+    if backend == "orjson":
+        return orjson.loads(data)
+    elif backend == "msgspec":
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def load(file_path: str, backend=None):
+    with open(file_path, "rb") as f:
+        return loads(f.read(), backend)
+
+
+def can_stream():
+    return ijson is not None
+
+
+def iter_events(f):
+    # (prefix, event, value) parse events of a binary file object, read
+    # incrementally. Numbers are decoded to int and float as by json.loads.
+    return ijson.parse(f, use_float=True)
+
+
+def iter_items(f, prefix: str):
+    # Each value found at prefix, such as "contained.item" for the entries of
+    # a top level "contained" list, built one at a time
+    return ijson.items(f, prefix, use_float=True)
+
+
+def dumps(obj, default=None, indent=None, backend=None):
+    '''
+    Encodes obj to a str like json.dumps(obj, default=default,
+    ensure_ascii=False, indent=indent): datetimes and other unsupported types
+    go to default, and dict keys that are not strings are converted to
+    strings. With orjson two float encodings differ from json: NaN and
+    infinities are written as null rather than NaN and Infinity, and exponents
+    have no plus sign or leading zero, so 1e16 and 1e-7 rather than 1e+16 and
+    1e-07.
+    '''
+    backend = backend if backend is not None else get_encode_backend(indent)
+    if backend == "orjson":
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent is not None:
+            option |= orjson.OPT_INDENT_2
+        encoded = orjson.dumps(obj, default=default, option=option)
+        if indent is not None and indent != 2:
+            encoded = widen_indent(encoded, indent)
+        return encoded.decode("utf-8")
+    return json.dumps(obj, default=default, ensure_ascii=False, indent=indent)
+
+
+def dump(obj, file_path: str, default=None, indent=None, backend=None):
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(dumps(obj, default, indent, backend))
@@ -1,4 +1,9 @@
+from data.units import intern_string
+
+
 class LabTest:
+    __slots__ = ("codings", "test_desc", "primary_id")
+
     def __init__(self, code_desc: str, code_dict: dict):
         self.codings = {}
         code_id = None
@@ -7,7 +12,7 @@ class LabTest:
             for coding in code_dict["coding"]:
                 if "system" in coding and "code" in coding:
                     if not coding["system"] in self.codings:
-                        self.codings[coding["system"]] = coding["code"]
+                        self.codings[intern_string(coding["system"])] = intern_string(coding["code"])
 
                     if coding["system"] == "http://loinc.org":
                         if code_desc is None and "display" in coding:
@@ -26,8 +31,8 @@ class LabTest:
         if code_desc is None or code_id is None:
             raise Exception("Code description or ID is None")
 
-        self.test_desc = code_desc
-        self.primary_id = code_id
+        self.test_desc = intern_string(code_desc)
+        self.primary_id = intern_string(code_id)
 
     # As data is traversed a test may be found to have more than one coding
     def add_coding(self, new_code_dict):
@@ -39,7 +44,7 @@ class LabTest:
                 continue
 
             if not coding["system"] in self.codings:
-                self.codings[coding["system"]] = coding["code"]
+                self.codings[intern_string(coding["system"])] = intern_string(coding["code"])
 
     def matches(self, other_test):
         if self.codings is None or other_test.codings is None:
@@ -60,3 +65,66 @@ class LabTest:
         out["testDescription"] = self.test_desc
         out["codings"] = self.codings
         return out
+
+    @staticmethod
+    def from_stored(test_desc: str, primary_id: str, codings: dict):
+        # Rebuilds a test saved to an ObservationStore
+        test = LabTest.__new__(LabTest)
+        test.codings = {intern_string(system): intern_string(code) for system, code in codings.items()}
+        test.test_desc = intern_string(test_desc)
+        test.primary_id = intern_string(primary_id)
+        return test
+
+
+class LabTestRegistry:
+    '''
+    The LabTests seen so far in the order first recorded, indexed by their
+    (system, code) coding pairs. A test matching any pair of an earlier test
+    is resolved to the first such test with dict lookups rather than by
+    comparing it against every known test. Indexes never change once assigned,
+    so an observation's test_index stays valid.
+    '''
+    def __init__(self):
+        self.tests = []
+        self.coding_index = {}
+
+    def __len__(self):
+        return len(self.tests)
+
+    def __getitem__(self, test_index: int):
+        return self.tests[test_index]
+
+    def __setitem__(self, test_index: int, test: LabTest):
+        replaced = self.tests[test_index] is not test
+        self.tests[test_index] = test
+        if replaced:
+            self.coding_index = {}
+            for i in range(len(self.tests)):
+                self.index_codings(i)
+        else:
+            self.index_codings(test_index)
+
+    def __iter__(self):
+        return iter(self.tests)
+
+    def index_codings(self, test_index: int):
+        for coding in self.tests[test_index].codings.items():
+            if coding not in self.coding_index or self.coding_index[coding] > test_index:
+                self.coding_index[coding] = test_index
+
+    def find(self, test: LabTest):
+        # Index of the first recorded test sharing a coding with test, or -1
+        test_index = -1
+        for coding in test.codings.items():
+            i = self.coding_index.get(coding)
+            if i is not None and (test_index < 0 or i < test_index):
+                test_index = i
+        return test_index
+
+    def append(self, test: LabTest):
+        self.tests.append(test)
+        self.index_codings(len(self.tests) - 1)
+
+    def add_coding(self, test_index: int, new_code_dict: dict):
+        self.tests[test_index].add_coding(new_code_dict)
+        self.index_codings(test_index)
@@ -1,7 +1,8 @@
 import re
 
-from data.labtest import LabTest
+from data.labtest import LabTest, LabTestRegistry
 from data.result import Result
+from data.units import VitalSignCategory, intern_string
 
 
 class CategoryError(AssertionError):
@@ -15,10 +16,15 @@ When constructed directly used to handle observations not belonging to vital sig
 
 
 class Observation:
-    def __init__(self, data: dict, obs_id: str, tests: list, date_codes: dict,
+    __slots__ = ("obs_id", "observation_complete", "category", "date", "code",
+                 "primary_code_id", "test", "test_index", "is_seen_test", "datecode",
+                 "unit", "value", "value_string", "value2", "result", "has_reference",
+                 "comment")
+
+    def __init__(self, data: dict, obs_id: str, tests: LabTestRegistry, date_codes: dict,
                  start_year: int, skip_long_values: bool,
                  skip_in_range_abnormal_results: bool, abnormal_boundary: float,
-                 vital_sign_categories: list, disallowed_codes: list):
+                 vital_sign_categories: list, disallowed_codes: list, test: LabTest = None):
         self.obs_id = obs_id
         self.observation_complete = False
 
@@ -27,22 +33,22 @@ class Observation:
                 raise ValueError("Observation value not found")
 
         if "text" in data["category"]:
-            self.category = data["category"]["text"]
+            self.category = intern_string(data["category"]["text"])
         else:
-            self.category = data["category"]["coding"][0]["code"]
+            self.category = intern_string(data["category"]["coding"][0]["code"])
 
         if self.category in vital_sign_categories:
             raise CategoryError("Observation for category "
                                 + self.category + " to be handled separately")
 
-        self.date = data["effectiveDateTime"][0:10]
+        self.date = intern_string(data["effectiveDateTime"][0:10])
 
         if start_year is not None:
             year = int(self.date[0:4])
             if year < start_year:
                 raise AssertionError("Observation year is before start year")
 
-        self.set_code_and_test(data, disallowed_codes, tests)
+        self.set_code_and_test(data, disallowed_codes, tests, test)
         self.datecode = self.date + self.primary_code_id
 
         if self.datecode in date_codes:
@@ -61,40 +67,32 @@ class Observation:
         self.comment = data["comments"] if "comments" in data else None
         self.observation_complete = True
 
-    def set_code_and_test(self, data, disallowed_codes, tests):
+    def set_code_and_test(self, data, disallowed_codes, tests, test=None):
         if "text" in data["code"]:
             self.code = data["code"]["text"]
         else:
             self.code = None
 
         self.primary_code_id = None
-        self.test = LabTest(self.code, data["code"])
+        # The test may already have been read from the code by the caller
+        self.test = test if test is not None else LabTest(self.code, data["code"])
         self.code = self.test.test_desc
 
         if self.code.upper() in disallowed_codes:
             raise AssertionError("Skipping observation for code " + self.code)
 
         self.primary_code_id = self.test.primary_id
-        self.test_index = -1
-        i = 0
-
-        for _test in tests:
-            if self.test.matches(_test):
-                self.test_index = i
-                break
-            i += 1
+        self.test_index = tests.find(self.test)
 
         if self.test_index < 0:
             self.is_seen_test = False
             self.test_index = len(tests)
         else:
             self.is_seen_test = True
-            saved_test = tests[self.test_index]
-            saved_test.add_coding(data["code"])
-            self.test = saved_test
+            tests.add_coding(self.test_index, data["code"])
+            self.test = tests[self.test_index]
             self.code = self.test.test_desc
             self.primary_code_id = self.test.primary_id
-            saved_test = None
 
     def set_value_and_value_string(self, data):
         self.unit = None
@@ -117,7 +115,7 @@ class Observation:
                 self.value = float(numbervalue)
             self.value_string = str(value)
             if "unit" in value_quantity:
-                self.unit = value_quantity["unit"]
+                self.unit = intern_string(value_quantity["unit"])
                 self.value_string += " " + self.unit
         # Blood pressure observations
         elif "component" in data:
@@ -141,7 +139,7 @@ class Observation:
                         component_value["valueQuantity"]["value"])
 
                 if "unit" in component_value["valueQuantity"]:
-                    self.unit = component_value["valueQuantity"]["unit"]
+                    self.unit = intern_string(component_value["valueQuantity"]["unit"])
 
             if self.value is None or self.value2 is None:
                 raise ValueError(
@@ -190,7 +188,7 @@ class Observation:
         except ValueError:
             pass
 
-    def to_dict(self, _id: str, tests: list):
+    def to_dict(self, _id: str, tests: LabTestRegistry):
         out = {}
         out["observationId"] = _id
         out["date"] = self.date
@@ -208,6 +206,35 @@ class Observation:
         out["observedResult"] = result
         return out
 
+    @staticmethod
+    def from_stored(row: dict, test: LabTest, test_index: int, is_seen_test: bool,
+                    skip_in_range_abnormal_results: bool, abnormal_boundary: float):
+        # Rebuilds a lab result saved to an ObservationStore, classifying its
+        # reference range under the current abnormal result options
+        obs = Observation.__new__(Observation)
+        obs.obs_id = row["obs_id"]
+        obs.category = intern_string(row["category"])
+        obs.date = intern_string(row["date"])
+        obs.test = test
+        obs.test_index = test_index
+        obs.is_seen_test = is_seen_test
+        obs.code = intern_string(row["code"])
+        obs.primary_code_id = test.primary_id
+        obs.datecode = row["datecode"]
+        obs.unit = intern_string(row["unit"])
+        obs.value = row["value"]
+        if row["value2"] is not None:
+            obs.value2 = row["value2"]
+        obs.value_string = row["value_string"]
+        obs.result = None
+        obs.has_reference = False
+        if row["range_text"] is not None:
+            obs.set_reference(skip_in_range_abnormal_results, abnormal_boundary,
+                              [{"text": row["range_text"]}], obs.unit, False)
+        obs.comment = row["comment"]
+        obs.observation_complete = True
+        return obs
+
 
 
 class ObservationVital(Observation):
@@ -221,7 +248,9 @@ class ObservationVital(Observation):
         - "Temperature"
         - "Weight"
     '''
-    def __init__(self, data: dict, obs_id: str, tests: list, date_codes: dict,
+    __slots__ = ("vital_sign_category",)
+
+    def __init__(self, data: dict, obs_id: str, tests: LabTestRegistry, date_codes: dict,
                  start_year: int, skip_long_values: bool,
                  skip_in_range_abnormal_results: bool, abnormal_boundary: float):
         super().__init__(data, obs_id, tests, date_codes, start_year, skip_long_values,
@@ -231,3 +260,24 @@ class ObservationVital(Observation):
     def set_vital_sign_category(self, vital_sign_category):
         self.vital_sign_category = vital_sign_category
 
+    @staticmethod
+    def from_stored(row: dict):
+        # Rebuilds a vital sign observation saved to a ParseSnapshot with the
+        # fields compiled into the vitals stats
+        obs = ObservationVital.__new__(ObservationVital)
+        obs.obs_id = row["obs_id"]
+        obs.category = intern_string(row["category"])
+        obs.date = intern_string(row["date"])
+        obs.code = intern_string(row["code"])
+        obs.unit = intern_string(row["unit"])
+        obs.value = row["value"]
+        if row["value2"] is not None:
+            obs.value2 = row["value2"]
+        obs.value_string = row["value_string"]
+        obs.result = None
+        obs.has_reference = False
+        obs.comment = None
+        obs.vital_sign_category = VitalSignCategory[row["vital_sign_category"]]
+        obs.observation_complete = True
+        return obs
+
@@ -1,32 +1,213 @@
-import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import os
 import traceback
 
+from data import json_backend
+from data.labtest import LabTest, LabTestRegistry
 from data.observation import Observation, ObservationVital, CategoryError
 from data.units import VitalSignCategory
 
 ## PROCESS CLINICAL RECORDS JSON DATA
 
+CLINICAL_RECORDS_FILE_CATEGORIES = ["Observation", "DiagnosticReport"]
+CLINICAL_RECORDS_BATCH_SIZE = 64
+CLINICAL_RECORDS_THREADS_PER_WORKER = 4
+# DiagnosticReport files at least this large are streamed if ijson is installed
+CLINICAL_RECORDS_STREAM_MIN_SIZE = 8 << 20
+LAB_REPORT_CATEGORIES = ["Lab", "LAB"]
+
+# Routing decisions for an observation before any Observation is built
+ROUTE_SKIP = "skip"
+ROUTE_VITAL = "vital"
+ROUTE_LAB = "lab"
+ROUTE_DUPLICATE = "duplicate"
+
+
+def new_health_file_record(f: str):
+    return {"file": f, "category": f[0:(f.index("-"))], "subject": None,
+            "contained": False, "observations": []}
+
+
+def get_health_file_record(f: str, file_data: dict):
+    # Reduces a decoded clinical-records file to what the parser uses: the
+    # subject name and the observations to process. Lab filtering happens here
+    # so worker processes send back none of the reports that would be skipped.
+    record = new_health_file_record(f)
+    if record["category"] == "Observation":
+        subject_data = file_data.get("subject")
+        if (subject_data is not None and "display" in subject_data
+                and subject_data["display"] is not None):
+            record["subject"] = subject_data["display"]
+        record["observations"].append(file_data)
+        return record
+    data_category = file_data["category"]["coding"][0]["code"]
+    if data_category not in LAB_REPORT_CATEGORIES:
+        return record
+    if "contained" in file_data:
+        record["contained"] = True
+        record["observations"] = file_data["contained"]
+    else:
+        record["observations"].append(file_data)
+    return record
+
+
+def decode_health_files(files: list):
+    # Worker process entry point for a batch of (filename, raw bytes) pairs
+    return [get_health_file_record(f, json_backend.loads(file_bytes)) for f, file_bytes in files]
+
+
+def scan_diagnostic_report(json_file):
+    # Reads a DiagnosticReport file only as far as needed to find its category
+    # code and whether it has a top level "contained" list, keeping no values
+    category_code = None
+    has_contained = False
+    for prefix, event, value in json_backend.iter_events(json_file):
+        if prefix == "category.coding.item.code" and category_code is None:
+            category_code = value
+            if category_code not in LAB_REPORT_CATEGORIES:
+                break
+        elif prefix == "" and event == "map_key" and value == "contained":
+            has_contained = True
+        if category_code is not None and has_contained:
+            break
+    return category_code, has_contained
+
+
+class SortedDateSet:
+    '''
+    Set of date strings that iterates and indexes in sorted order. Adding a
+    date is a set insert, and the sorted list is only rebuilt on the first
+    read after the set has changed.
+    '''
+    def __init__(self, reverse=False):
+        self.dates = set()
+        self.reverse = reverse
+        self.sorted_dates = []
+
+    def __contains__(self, date):
+        return date in self.dates
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        return iter(self.get_sorted())
+
+    def __getitem__(self, index):
+        return self.get_sorted()[index]
+
+    def add(self, date: str):
+        if date not in self.dates:
+            self.dates.add(date)
+            self.sorted_dates = None
+
+    def get_sorted(self):
+        if self.sorted_dates is None:
+            self.sorted_dates = sorted(self.dates, reverse=self.reverse)
+        return self.sorted_dates
+
+
+class ObservationsPivot:
+    '''
+    Sparse code -> date -> observation view of the recorded results shared by
+    the table writers. Where a code has results under more than one code ID
+    on a date, the code ID seen first for the code is shown, as the tables
+    always have. abnormal_results holds only the codes with abnormal results
+    and, for each date, the first abnormal result in code ID order.
+    '''
+    def __init__(self, data):
+        self.codes = sorted(data.observation_code_ids)
+        self.results = {}
+        self.abnormal_results = {}
+        data.sort_code_observations()
+        for code in self.codes:
+            results = {}
+            for obs in data.code_observations.get(code, []):
+                if obs.date not in results:
+                    results[obs.date] = obs
+            self.results[code] = results
+            for code_id in data.observation_code_ids[code]:
+                if code_id not in data.abnormal_results:
+                    continue
+                if code not in self.abnormal_results:
+                    self.abnormal_results[code] = {}
+                abnormal_results = self.abnormal_results[code]
+                for obs in data.abnormal_results[code_id]:
+                    if obs.date not in abnormal_results:
+                        abnormal_results[obs.date] = obs
+
 
 class ObservationsData:
     def __init__(self):
         self.observations = {}
         self.observations_vital_signs = {}
-        self.observation_dates = []
-        self.reference_dates = []
+        # Most recent first
+        self.observation_dates = SortedDateSet(reverse=True)
+        self.reference_dates = SortedDateSet()
         self.observation_codes = {}
         self.observation_code_ids = {}
-        self.tests = []
+        self.observation_code_id_pairs = set()
+        self.code_observations = {}
+        self.tests = LabTestRegistry()
         self.date_codes = {}
         self.ranges = {}
         self.abnormal_results = {}
-        self.abnormal_result_dates = []
+        self.abnormal_result_dates = SortedDateSet(reverse=True)
         self.total_abnormal_results = 0
         self.abnormal_result_interpretations_by_code = {}
+        self.pivot = None
 
     def sort(self):
-        self.observation_dates.sort()
-        self.observation_dates.reverse()
+        self.observation_dates.get_sorted()
+        self.reference_dates.get_sorted()
+        self.abnormal_result_dates.get_sorted()
+
+    def add_observation(self, obs_id: str, obs: Observation):
+        self.observations[obs_id] = obs
+        if obs.is_seen_test:
+            self.tests[obs.test_index] = obs.test
+        else:
+            self.tests.append(obs.test)
+        if obs.primary_code_id not in self.observation_codes:
+            self.observation_codes[obs.primary_code_id] = obs.code
+        # Code IDs keep the order first seen for each code
+        if (obs.code, obs.primary_code_id) not in self.observation_code_id_pairs:
+            self.observation_code_id_pairs.add((obs.code, obs.primary_code_id))
+            if obs.code not in self.observation_code_ids:
+                self.observation_code_ids[obs.code] = []
+            self.observation_code_ids[obs.code].append(obs.primary_code_id)
+        if obs.date is not None:
+            self.observation_dates.add(obs.date)
+            if obs.has_reference:
+                self.reference_dates.add(obs.date)
+            if obs.code not in self.code_observations:
+                self.code_observations[obs.code] = []
+            self.code_observations[obs.code].append(obs)
+
+        self.date_codes[obs.datecode] = obs_id
+
+        if obs.has_reference and obs.result and obs.result.is_abnormal:
+            self.add_abnormal_result(obs)
+
+    def sort_code_observations(self):
+        # Most recent first, then in the order the code's IDs were first seen
+        for code, observations in self.code_observations.items():
+            code_ids = self.observation_code_ids[code]
+            observations.sort(key=lambda obs: code_ids.index(obs.primary_code_id))
+            observations.sort(key=lambda obs: obs.date, reverse=True)
+
+    def get_pivot(self):
+        # Built on first use, once all results are recorded
+        if self.pivot is None:
+            self.pivot = ObservationsPivot(self)
+        return self.pivot
+
+    def add_abnormal_result(self, obs: Observation):
+        if obs.primary_code_id not in self.abnormal_results:
+            self.abnormal_results[obs.primary_code_id] = []
+        self.abnormal_results[obs.primary_code_id].append(obs)
+        self.abnormal_result_dates.add(obs.date)
 
     def determine_abnormal_results(self, verbose, skip_in_range_abnormal_results, in_range_abnormal_boundary):
         ## APPLY RANGES TO CLINICAL RECORDS RESULTS
@@ -34,65 +215,54 @@ class ObservationsData:
             if verbose:
                 print("\nConsolidating ranges and validating all results where "
                         + "ranges apply are tested for abnormality...\n")
+            self.sort_code_observations()
             # Construct ranges object
             for code in sorted(self.observation_code_ids):
-                range_found = False
-                for date in self.observation_dates:
-                    if range_found:
+                for observation in self.code_observations[code]:
+                    if observation.date in self.reference_dates and observation.has_reference:
+                        self.ranges[code] = observation.result.range_text
                         break
-                    for code_id in self.observation_code_ids[code]:
-                        datecode = date + code_id
-                        if datecode in self.date_codes:
-                            observation = self.observations[self.date_codes[datecode]]
-                            if date in self.reference_dates and observation.has_reference:
-                                self.ranges[code] = observation.result.range_text
-                                range_found = True
-                                break
             for code in sorted(self.observation_code_ids):
                 if code not in self.ranges:
                     continue
                 code_range = self.ranges[code]
                 range_list = [{"text": code_range}]
-                for date in self.observation_dates:
-                    for code_id in self.observation_code_ids[code]:
-                        datecode = date + code_id
-                        if datecode in self.date_codes:
-                            obs = self.observations[self.date_codes[datecode]]
-                            if not obs.has_reference:
-                                if verbose:
-                                    print("Found missing reference range for code "
-                                            + code + " on " + date + " - attempting "
-                                            + "to apply range from other results")
-                                obs.set_reference(skip_in_range_abnormal_results,
-                                                in_range_abnormal_boundary,
-                                                range_list, obs.unit, True)
-                                if obs.has_reference:
-                                    if obs.date not in self.reference_dates:
-                                        self.reference_dates.append(obs.date)
-                                    if obs.result.is_abnormal:
-                                        if obs.primary_code_id not in self.abnormal_results:
-                                            self.abnormal_results[obs.primary_code_id] = []
-                                        results = self.abnormal_results[obs.primary_code_id]
-                                        results.append(obs)
-                                        self.abnormal_results[obs.primary_code_id] = results
-                                        if obs.date not in self.abnormal_result_dates:
-                                            self.abnormal_result_dates.append(obs.date)
-
-        self.abnormal_result_dates.sort()
-        self.abnormal_result_dates.reverse()
-        self.reference_dates.sort()
+                for obs in self.code_observations[code]:
+                    if not obs.has_reference:
+                        if verbose:
+                            print("Found missing reference range for code "
+                                    + code + " on " + obs.date + " - attempting "
+                                    + "to apply range from other results")
+                        obs.set_reference(skip_in_range_abnormal_results,
+                                        in_range_abnormal_boundary,
+                                        range_list, obs.unit, True)
+                        if obs.has_reference:
+                            self.reference_dates.add(obs.date)
+                            if obs.result.is_abnormal:
+                                self.add_abnormal_result(obs)
+
+        self.sort()
 
 
 class ObservationJSONDataParser:
     category_vital_signs = "Vital Signs"
     disallowed_codes = ["NARRATIVE", "REQUEST PROBLEM"]
 
-    def __init__(self, args, custom_data_files, observations_data):
+    def __init__(self, args, custom_data_files, observations_data, export_zip=None, manifest=None):
         self.args = args
         self.verbose = args.verbose
         self.base_dir = args.base_dir
         self.subject = args.subject
-        self.health_files = os.listdir(self.base_dir)
+        self.export_zip = export_zip
+        self.manifest = manifest
+        self.health_files = []
+        self.zip_health_files = set()
+        if self.export_zip is not None:
+            self.health_files = self.export_zip.list_clinical_records()
+            self.zip_health_files = set(self.health_files)
+        # Custom reports are written to disk even when reading from a zip
+        if os.path.isdir(self.base_dir):
+            self.health_files += [f for f in os.listdir(self.base_dir) if f not in self.zip_health_files]
         self.custom_data_files = custom_data_files
         self.data = observations_data if observations_data else ObservationsData()
         self.vital_sign_categories = [
@@ -101,55 +271,194 @@ class ObservationJSONDataParser:
 
     def parse(self):
         print("Parsing clinical-records JSON...")        
-        for f in self.health_files:
-            file_category = f[0:(f.index("-"))]
-            f_addr = os.path.join(self.base_dir, f)
-            # Get data from Observation files
-            if file_category == "Observation":
-                file_data = json.load(open(f_addr))
-                if "name" not in self.subject and "subject" in file_data:
-                    subject_data = file_data["subject"]
-                    if (subject_data is not None and "display" in subject_data
-                            and subject_data["display"] is not None):
-                        self.subject["name"] = subject_data["display"]
-                        if self.verbose:
-                            print("Identified subject: " + self.subject["name"])
+        health_files = [f for f in self.health_files
+                        if f[0:(f.index("-"))] in CLINICAL_RECORDS_FILE_CATEGORIES]
+        # Records are merged one at a time in file order so the result is the
+        # same however many workers decoded them
+        for record in self.iter_health_file_records(health_files):
+            self.add_health_file_record(record)
+        if self.manifest is not None:
+            if len(self.manifest.reused_files) > 0:
+                print(f"Reused {len(self.manifest.reused_files)} unchanged clinical-records files "
+                      + "from manifest " + self.manifest.manifest_path)
+            self.manifest.save()
+
+        self.data.sort()
+        return self.data
+
+    def add_health_file_record(self, record: dict):
+        f = record["file"]
+        # Get data from Observation files
+        if record["category"] == "Observation":
+            if "name" not in self.subject and record["subject"] is not None:
+                self.subject["name"] = record["subject"]
+                if self.verbose:
+                    print("Identified subject: " + self.subject["name"])
+            for observation in record["observations"]:
                 try:
-                    self.process_observation(file_data, f)
+                    self.process_observation(observation, f)
                 except Exception as e:
                     if self.verbose:
                         print(e)
-                    continue
-            # Get data from Diagnostic Report type files
-            elif file_category == "DiagnosticReport":
-                if "-CUSTOM" in f_addr:
-                    self.custom_data_files.append(f_addr)
-                file_data = json.load(open(f_addr))
-                data_category = file_data["category"]["coding"][0]["code"]
-                if data_category not in ["Lab", "LAB"]:
-                    continue
-                # Some Diagnostic Report files have multiple results contained
-                if "contained" in file_data:
-                    i = 0
-                    for observation in file_data["contained"]:
-                        try:
-                            self.process_observation(observation, f + "[" + str(i) + "]")
-                        except Exception as e:
-                            if self.verbose:
-                                print(e)
-                            continue
-                        i += 1
-                else:
+        # Get data from Diagnostic Report type files
+        else:
+            f_addr = self.get_health_file_path(f)
+            if "-CUSTOM" in f_addr:
+                self.custom_data_files.append(f_addr)
+            # Some Diagnostic Report files have multiple results contained
+            if record["contained"]:
+                i = 0
+                for observation in record["observations"]:
                     try:
-                        self.process_observation(file_data, f)
+                        self.process_observation(observation, f + "[" + str(i) + "]")
                     except Exception as e:
                         if self.verbose:
                             print(e)
                         continue
+                    i += 1
+            else:
+                for observation in record["observations"]:
+                    try:
+                        self.process_observation(observation, f)
+                    except Exception as e:
+                        if self.verbose:
+                            print(e)
 
-        self.data.sort()
-        return self.data
+    def iter_health_file_records(self, health_files: list):
+        # Large DiagnosticReport files are streamed here in their place in file
+        # order, and the rest are decoded whole
+        stream_files = set(f for f in health_files if self.is_stream_health_file(f))
+        decode_files = [f for f in health_files if f not in stream_files]
+        if self.args.workers > 1 and len(decode_files) > CLINICAL_RECORDS_BATCH_SIZE:
+            records = self.iter_health_file_records_parallel(decode_files)
+        else:
+            records = (self.load_health_file_record(f) for f in decode_files)
+        for f in health_files:
+            if f in stream_files:
+                yield self.stream_health_file_record(f)
+            else:
+                yield next(records)
+        records.close()
+
+    def is_stream_health_file(self, f):
+        if (not self.args.json_streaming or not json_backend.can_stream()
+                or f[0:(f.index("-"))] != "DiagnosticReport"):
+            return False
+        return self.get_health_file_size(f) >= CLINICAL_RECORDS_STREAM_MIN_SIZE
+
+    def stream_health_file_record(self, f):
+        '''
+        Builds the record for a large DiagnosticReport file without decoding
+        it whole. The file is scanned for its category first, as "category"
+        may follow "contained", then read a second time to hand each contained
+        observation to the parser as it is built, so at most one observation of
+        the file is held in memory.
+        '''
+        with self.open_health_file(f) as json_file:
+            category_code, has_contained = scan_diagnostic_report(json_file)
+        if category_code not in LAB_REPORT_CATEGORIES:
+            return new_health_file_record(f)
+        if not has_contained:
+            return get_health_file_record(f, self.load_health_file(f))
+        if self.verbose:
+            print("Streaming contained observations from " + f)
+        record = new_health_file_record(f)
+        record["contained"] = True
+        record["observations"] = self.iter_contained_observations(f)
+        return record
+
+    def iter_contained_observations(self, f):
+        with self.open_health_file(f) as json_file:
+            yield from json_backend.iter_items(json_file, "contained.item")
+
+    def iter_health_file_records_parallel(self, health_files: list):
+        # Threads read files in batches and hand each batch to a worker process
+        # to decode, keeping enough batches in flight to overlap reads with
+        # decoding. Files unchanged since the manifest was saved are not sent.
+        # Batches are yielded in file order.
+        workers = self.args.workers
+        max_pending = workers * CLINICAL_RECORDS_THREADS_PER_WORKER
+        if self.verbose:
+            print(f"Decoding {len(health_files)} clinical-records files with {workers} workers")
+        with ThreadPoolExecutor(max_workers=max_pending) as read_executor, \
+                ProcessPoolExecutor(max_workers=workers) as decode_executor:
+            def load_batch(batch):
+                records = {}
+                files = []
+                for f in batch:
+                    record, file_bytes = self.read_health_file_or_record(f)
+                    if record is None:
+                        files.append((f, file_bytes))
+                    else:
+                        records[f] = record
+                if len(files) > 0:
+                    for record in decode_executor.submit(decode_health_files, files).result():
+                        if self.manifest is not None:
+                            self.manifest.set_record(record["file"], record)
+                        records[record["file"]] = record
+                return [records[f] for f in batch]
+
+            pending = deque()
+            for i in range(0, len(health_files), CLINICAL_RECORDS_BATCH_SIZE):
+                batch = health_files[i:i + CLINICAL_RECORDS_BATCH_SIZE]
+                pending.append(read_executor.submit(load_batch, batch))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def get_health_file_path(self, f):
+        if f in self.zip_health_files:
+            return self.export_zip.get_clinical_record_path(f)
+        return os.path.join(self.base_dir, f)
+
+    def load_health_file_record(self, f):
+        if self.manifest is None:
+            return get_health_file_record(f, self.load_health_file(f))
+        record, file_bytes = self.read_health_file_or_record(f)
+        if record is None:
+            record = get_health_file_record(f, json_backend.loads(file_bytes))
+            self.manifest.set_record(f, record)
+        return record
+
+    def read_health_file_or_record(self, f):
+        # Returns (record, None) for a file unchanged since the manifest was
+        # saved, otherwise (None, file bytes) for the file to be decoded
+        if self.manifest is None:
+            return None, self.read_health_file(f)
+        size, modified = self.get_health_file_stat(f)
+        record = self.manifest.find_record(f, size, modified)
+        if record is not None:
+            return record, None
+        file_bytes = self.read_health_file(f)
+        return self.manifest.match_record(f, size, modified, file_bytes), file_bytes
+
+    def get_health_file_stat(self, f):
+        if f in self.zip_health_files:
+            return self.export_zip.get_clinical_record_stat(f)
+        stat = os.stat(os.path.join(self.base_dir, f))
+        return stat.st_size, stat.st_mtime_ns
 
+    def load_health_file(self, f):
+        if f in self.zip_health_files:
+            return self.export_zip.load_clinical_record(f)
+        return json_backend.load(os.path.join(self.base_dir, f))
+
+    def open_health_file(self, f):
+        if f in self.zip_health_files:
+            return self.export_zip.open_clinical_record(f)
+        return open(os.path.join(self.base_dir, f), "rb")
+
+    def get_health_file_size(self, f):
+        if f in self.zip_health_files:
+            return self.export_zip.get_clinical_record_size(f)
+        return os.path.getsize(os.path.join(self.base_dir, f))
+
+    def read_health_file(self, f):
+        if f in self.zip_health_files:
+            return self.export_zip.read_clinical_record(f)
+        with open(os.path.join(self.base_dir, f), "rb") as json_file:
+            return json_file.read()
 
 
     def handle_vital_sign_category_observation(self, data: dict, obs_id: str,
@@ -214,13 +523,80 @@ class ObservationJSONDataParser:
             print(f"Vital sign observation recorded for {obs_v.code} on {obs_v.date}")
 
 
+    def route_observation(self, data: dict):
+        '''
+        Decides from the raw observation dict whether it is skipped, a vital
+        sign, a duplicate of a recorded result or a lab result to build, in
+        the same order Observation would reject it, without raising. Returns
+        (route, test, message) where test is the LabTest read for a lab result
+        and message is the reason for a skip or duplicate, if any. Malformed
+        observations are routed as lab results so Observation reports them.
+        '''
+        if "valueString" not in data and "valueQuantity" not in data and "component" not in data:
+            return ROUTE_SKIP, None, None
+        category_data = data.get("category")
+        if not isinstance(category_data, dict):
+            return ROUTE_LAB, None, None
+        if "text" in category_data:
+            category = category_data["text"]
+        else:
+            coding = category_data.get("coding")
+            if not isinstance(coding, list) or len(coding) == 0 or "code" not in coding[0]:
+                return ROUTE_LAB, None, None
+            category = coding[0]["code"]
+        effective_date_time = data.get("effectiveDateTime")
+        if not isinstance(effective_date_time, str):
+            return (ROUTE_VITAL if category in self.vital_sign_categories else ROUTE_LAB), None, None
+        date = effective_date_time[0:10]
+        if (self.args.start_year is not None and date[0:4].isdigit()
+                and int(date[0:4]) < self.args.start_year):
+            return ROUTE_SKIP, None, "Observation year is before start year"
+        if category in self.vital_sign_categories:
+            return ROUTE_VITAL, None, None
+        code_data = data.get("code")
+        if not isinstance(code_data, dict) or not date[0:4].isdigit():
+            return ROUTE_LAB, None, None
+        try:
+            test = LabTest(code_data.get("text"), code_data)
+        except Exception:
+            return ROUTE_LAB, None, None
+        if not isinstance(test.test_desc, str):
+            return ROUTE_LAB, None, None
+        if test.test_desc.upper() in ObservationJSONDataParser.disallowed_codes:
+            return ROUTE_SKIP, None, "Skipping observation for code " + test.test_desc
+        primary_code_id = test.primary_id
+        code = test.test_desc
+        test_index = self.data.tests.find(test)
+        if test_index >= 0:
+            # Codings are merged into a known test even if the result is then rejected
+            self.data.tests.add_coding(test_index, code_data)
+            primary_code_id = self.data.tests[test_index].primary_id
+            code = self.data.tests[test_index].test_desc
+        datecode = date + primary_code_id
+        if datecode in self.data.date_codes:
+            return (ROUTE_DUPLICATE, None,
+                    "Datecode " + datecode + " for code " + code + " already recorded")
+        return ROUTE_LAB, test, None
+
     def process_observation(self, data: dict, obs_id: str):
+        route, test, message = self.route_observation(data)
+        if route == ROUTE_VITAL:
+            self.handle_vital_sign_category_observation(data, obs_id,
+                    self.args.start_year,
+                    self.args.skip_long_values,
+                    self.args.skip_in_range_abnormal_results,
+                    self.args.in_range_abnormal_boundary)
+            return
+        elif route != ROUTE_LAB:
+            if message is not None and self.verbose:
+                print(message)
+            return
         obs = None
         try:
             obs = Observation(data, obs_id, self.data.tests, self.data.date_codes, self.args.start_year,
                     self.args.skip_long_values, self.args.skip_in_range_abnormal_results,
                     self.args.in_range_abnormal_boundary, self.vital_sign_categories,
-                    ObservationJSONDataParser.disallowed_codes)
+                    ObservationJSONDataParser.disallowed_codes, test)
         except ValueError:
             pass
         except CategoryError:
@@ -247,35 +623,7 @@ class ObservationJSONDataParser:
         if obs.date is not None and obs.date in self.args.skip_dates:
             raise Exception("Skipping observation on date " + obs.date)
 
-        self.data.observations[obs_id] = obs
-        if obs.is_seen_test:
-            self.data.tests[obs.test_index] = obs.test
-        else:
-            self.data.tests.append(obs.test)
-        if obs.primary_code_id not in self.data.observation_codes:
-            self.data.observation_codes[obs.primary_code_id] = obs.code
-        if obs.code not in self.data.observation_code_ids:
-            self.data.observation_code_ids[obs.code] = []
-        code_ids = self.data.observation_code_ids[obs.code]
-        if obs.primary_code_id not in code_ids:
-            code_ids.append(obs.primary_code_id)
-            self.data.observation_code_ids[obs.code] = code_ids
-        if obs.date is not None:
-            if obs.date not in self.data.observation_dates:
-                self.data.observation_dates.append(obs.date)
-            if obs.has_reference and obs.date not in self.data.reference_dates:
-                self.data.reference_dates.append(obs.date)
-
-        self.data.date_codes[obs.datecode] = obs_id
-
-        if obs.has_reference and obs.result and obs.result.is_abnormal:
-            if obs.primary_code_id not in self.data.abnormal_results:
-                self.data.abnormal_results[obs.primary_code_id] = []
-            results = self.data.abnormal_results[obs.primary_code_id]
-            results.append(obs)
-            self.data.abnormal_results[obs.primary_code_id] = results
-            if obs.date not in self.data.abnormal_result_dates:
-                self.data.abnormal_result_dates.append(obs.date)
+        self.data.add_observation(obs_id, obs)
         if self.verbose:
             print(f"Observation recorded for {obs.code} on {obs.date}")
 
@@ -0,0 +1,227 @@
+from datetime import datetime
+import json
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+from data.labtest import LabTest
+from data.observation import Observation
+from data.observation_json_parser import ObservationsData
+
+OBSERVATION_STORE_FILENAME = "observations.db"
+OBSERVATION_STORE_VERSION = 1
+
+OBSERVATION_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS tests (
+    primary_id TEXT PRIMARY KEY,
+    test_desc TEXT NOT NULL,
+    codings TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS observations (
+    seq INTEGER PRIMARY KEY,
+    datecode TEXT NOT NULL UNIQUE,
+    obs_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    category TEXT,
+    code TEXT NOT NULL,
+    primary_code_id TEXT NOT NULL REFERENCES tests (primary_id),
+    unit TEXT,
+    value REAL,
+    value2 REAL,
+    value_string TEXT NOT NULL,
+    comment TEXT,
+    updated TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS observations_code_date ON observations (code, date);
+CREATE INDEX IF NOT EXISTS observations_date ON observations (date);
+CREATE INDEX IF NOT EXISTS observations_obs_id ON observations (obs_id);
+CREATE TABLE IF NOT EXISTS results (
+    datecode TEXT PRIMARY KEY REFERENCES observations (datecode) ON DELETE CASCADE,
+    range_text TEXT NOT NULL,
+    is_abnormal INTEGER NOT NULL,
+    interpretation TEXT NOT NULL);
+"""
+
+OBSERVATION_COLUMNS = ["obs_id", "datecode", "date", "category", "code", "primary_code_id",
+                       "unit", "value", "value2", "value_string", "comment"]
+
+
+class ObservationStore:
+    '''
+    SQLite database of the lab results and tests parsed across runs. Each run
+    upserts what it parsed, keyed by the date and code ID of each result, so
+    results no longer in an export or parsed from an earlier export are kept.
+    Reports are then built from everything stored, and the database can be
+    queried by date and code without parsing an export again. Vital signs are
+    not stored and are reported from the current export.
+    '''
+    def __init__(self, store_path: str, verbose=False, read_only=False):
+        self.store_path = store_path
+        self.verbose = verbose
+        if read_only:
+            # Readers never create the database or its schema
+            self.connection = sqlite3.connect(
+                "file:" + pathname2url(os.path.abspath(store_path)) + "?mode=ro", uri=True)
+        else:
+            self.connection = sqlite3.connect(store_path)
+        self.connection.row_factory = sqlite3.Row
+        try:
+            if read_only:
+                self.check_version()
+                return
+            self.connection.execute("PRAGMA foreign_keys = ON")
+            with self.connection:
+                self.connection.executescript(OBSERVATION_STORE_SCHEMA)
+                if self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone() is None:
+                    self.connection.execute("INSERT INTO meta (key, value) VALUES ('version', ?)",
+                                            (str(OBSERVATION_STORE_VERSION),))
+                self.check_version()
+        except Exception:
+            self.connection.close()
+            raise
+
+    def check_version(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or int(row["value"]) != OBSERVATION_STORE_VERSION:
+            raise Exception("Observation store " + self.store_path
+                            + " was created by a different version and can't be used.")
+
+    def mark_reported(self):
+        # Written once the reports from this store are saved, so the store is
+        # newer than the report files and readers know it is current
+        with self.connection:
+            self.connection.execute("INSERT INTO meta (key, value) VALUES ('reported', ?) "
+                                    + "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                                    (datetime.now().isoformat(),))
+
+    def close(self):
+        self.connection.close()
+
+    def save_observations(self, observations_data: ObservationsData):
+        updated = datetime.now().isoformat()
+        tests = {row["primary_id"]: (row["test_desc"], json.loads(row["codings"]))
+                 for row in self.connection.execute("SELECT * FROM tests")}
+        for test in observations_data.tests:
+            if test.primary_id in tests:
+                test_desc, codings = tests[test.primary_id]
+                # Systems keep the code first seen for them, as in LabTest.add_coding
+                for system, code in test.codings.items():
+                    if system not in codings:
+                        codings[system] = code
+            else:
+                tests[test.primary_id] = (test.test_desc, dict(test.codings))
+        observation_rows = []
+        result_rows = []
+        unreferenced_datecodes = []
+        for obs_id, obs in observations_data.observations.items():
+            observation_rows.append((obs_id, obs.datecode, obs.date, obs.category, obs.code,
+                                     obs.primary_code_id, obs.unit, obs.value,
+                                     getattr(obs, "value2", None), obs.value_string,
+                                     None if obs.comment is None else json.dumps(obs.comment),
+                                     updated))
+            if obs.has_reference:
+                result_rows.append((obs.datecode, obs.result.range_text,
+                                    int(obs.result.is_abnormal), obs.result.interpretation))
+            else:
+                unreferenced_datecodes.append((obs.datecode,))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO tests (primary_id, test_desc, codings) VALUES (?, ?, ?) "
+                + "ON CONFLICT (primary_id) DO UPDATE SET codings = excluded.codings",
+                [(primary_id, test_desc, json.dumps(codings))
+                 for primary_id, (test_desc, codings) in tests.items()])
+            # A file parsed again with a different date or code replaces its earlier result
+            self.connection.executemany(
+                "DELETE FROM observations WHERE obs_id = ? AND datecode != ?",
+                [(row[0], row[1]) for row in observation_rows])
+            self.connection.executemany(
+                "INSERT INTO observations (" + ", ".join(OBSERVATION_COLUMNS) + ", updated) "
+                + "VALUES (" + ", ".join(["?"] * (len(OBSERVATION_COLUMNS) + 1)) + ") "
+                + "ON CONFLICT (datecode) DO UPDATE SET "
+                + ", ".join(column + " = excluded." + column for column in OBSERVATION_COLUMNS
+                            if column != "datecode")
+                + ", updated = excluded.updated",
+                observation_rows)
+            self.connection.executemany(
+                "INSERT INTO results (datecode, range_text, is_abnormal, interpretation) "
+                + "VALUES (?, ?, ?, ?) ON CONFLICT (datecode) DO UPDATE SET "
+                + "range_text = excluded.range_text, is_abnormal = excluded.is_abnormal, "
+                + "interpretation = excluded.interpretation",
+                result_rows)
+            self.connection.executemany("DELETE FROM results WHERE datecode = ?", unreferenced_datecodes)
+        if self.verbose:
+            print(f"Saved {len(observation_rows)} results to observation store " + self.store_path)
+
+    def load_observations_data(self, skip_in_range_abnormal_results: bool,
+                               in_range_abnormal_boundary: float, start_year=None, skip_dates=None):
+        '''
+        Builds ObservationsData from every stored result in the order first
+        stored, with ranges classified under the given abnormal result options.
+        '''
+        observations_data = ObservationsData()
+        tests = {}
+        test_indexes = {}
+        for row in self.connection.execute("SELECT * FROM tests"):
+            tests[row["primary_id"]] = LabTest.from_stored(
+                row["test_desc"], row["primary_id"], json.loads(row["codings"]))
+        query = ("SELECT observations.*, results.range_text FROM observations "
+                 + "LEFT JOIN results ON results.datecode = observations.datecode")
+        parameters = []
+        if start_year is not None:
+            query += " WHERE observations.date >= ?"
+            parameters.append(f"{start_year:04d}")
+        query += " ORDER BY observations.seq"
+        for row in self.connection.execute(query, parameters):
+            if skip_dates is not None and row["date"] in skip_dates:
+                continue
+            row = dict(row)
+            row["comment"] = None if row["comment"] is None else json.loads(row["comment"])
+            test = tests[row["primary_code_id"]]
+            is_seen_test = row["primary_code_id"] in test_indexes
+            if not is_seen_test:
+                test_indexes[row["primary_code_id"]] = len(test_indexes)
+            obs = Observation.from_stored(row, test, test_indexes[row["primary_code_id"]], is_seen_test,
+                                          skip_in_range_abnormal_results, in_range_abnormal_boundary)
+            observations_data.add_observation(row["obs_id"], obs)
+        observations_data.sort()
+        return observations_data
+
+    def update(self, observations_data: ObservationsData, args):
+        # Saves the results of this run and returns all stored results for the report
+        self.save_observations(observations_data)
+        stored_data = self.load_observations_data(
+            args.skip_in_range_abnormal_results, args.in_range_abnormal_boundary,
+            args.start_year, args.skip_dates)
+        # Vital sign results from clinical records are compiled into the vitals stats
+        stored_data.observations_vital_signs = observations_data.observations_vital_signs
+        print(f"Reporting {len(stored_data.observations)} results from observation store "
+              + self.store_path)
+        return stored_data
+
+    def get_observation_rows(self, code=None, start_date=None, end_date=None, abnormal_only=False):
+        # One row per stored result, most recent first, using the (code, date)
+        # index when a code is given and the (date) index otherwise. Results
+        # are abnormal as classified by the run that last stored them.
+        query = ("SELECT observations.date, observations.code, tests.test_desc AS description, "
+                 + "observations.value, observations.value_string, observations.unit, "
+                 + "results.range_text AS range, results.is_abnormal, results.interpretation "
+                 + "FROM observations JOIN tests ON tests.primary_id = observations.primary_code_id "
+                 + "LEFT JOIN results ON results.datecode = observations.datecode")
+        conditions = []
+        parameters = []
+        if code is not None:
+            conditions.append("observations.code = ?")
+            parameters.append(code)
+        if start_date is not None:
+            conditions.append("observations.date >= ?")
+            parameters.append(start_date)
+        if end_date is not None:
+            conditions.append("observations.date <= ?")
+            parameters.append(end_date)
+        if abnormal_only:
+            conditions.append("results.is_abnormal = 1")
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY observations.date DESC, observations.seq"
+        return [dict(row) for row in self.connection.execute(query, parameters)]
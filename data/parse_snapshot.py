@@ -0,0 +1,109 @@
+from datetime import datetime
+import os
+
+from data.atomic_save import save_atomic
+from data import json_backend
+from data.labtest import LabTest
+from data.observation import Observation, ObservationVital
+from data.observation_json_parser import ObservationsData
+
+PARSE_SNAPSHOT_VERSION = 2
+
+
+def get_observation_row(obs_id: str, obs: Observation):
+    return {"obs_id": obs_id, "test_index": obs.test_index, "category": obs.category,
+            "date": obs.date, "code": obs.code, "datecode": obs.datecode, "unit": obs.unit,
+            "value": obs.value, "value2": getattr(obs, "value2", None),
+            "value_string": obs.value_string,
+            "range_text": obs.result.range_text if obs.has_reference else None,
+            "comment": obs.comment}
+
+
+def get_vital_row(obs: ObservationVital):
+    return {"obs_id": obs.obs_id, "category": obs.category, "date": obs.date, "code": obs.code,
+            "unit": obs.unit, "value": obs.value, "value2": getattr(obs, "value2", None),
+            "value_string": obs.value_string, "vital_sign_category": obs.vital_sign_category.name}
+
+
+class ParseSnapshot:
+    '''
+    Saves the clinical records results parsed in a run as JSON, taken before
+    abnormal results are determined, so a later run with --reclassify can
+    apply different abnormal result thresholds and rewrite the reports
+    without parsing clinical-records again. Only the results and vital sign
+    observations are saved, as the vitals from export.xml are reloaded from
+    the XML parse cache.
+    '''
+    def __init__(self, snapshot_path: str, args):
+        self.snapshot_path = snapshot_path
+        self.args = args
+        self.verbose = args.verbose
+
+    def get_key(self):
+        # Options applied while parsing, which a reclassified run can't change
+        return {
+            "version": PARSE_SNAPSHOT_VERSION,
+            "startYear": self.args.start_year,
+            "skipLongValues": self.args.skip_long_values,
+            "skipDates": sorted(self.args.skip_dates),
+            "onlyClinicalRecords": self.args.only_clinical_records,
+            "aggregatesOnly": self.args.aggregates_only,
+            "normalHeightUnit": self.args.normal_height_unit.name,
+            "normalWeightUnit": self.args.normal_weight_unit.name,
+            "normalTemperatureUnit": self.args.normal_temperature_unit.name}
+
+    def save(self, observations_data: ObservationsData, subject: dict, custom_data_files: list):
+        snapshot = {"key": self.get_key(), "created": datetime.now().isoformat(),
+                    "subject": subject, "customDataFiles": custom_data_files,
+                    "tests": [[test.test_desc, test.primary_id, test.codings]
+                              for test in observations_data.tests],
+                    "observations": [get_observation_row(obs_id, obs)
+                                     for obs_id, obs in observations_data.observations.items()],
+                    "vitalSigns": {date: [get_vital_row(obs) for obs in observations]
+                                   for date, observations in observations_data.observations_vital_signs.items()}}
+        saved = save_atomic(self.snapshot_path, lambda path: json_backend.dump(snapshot, path),
+                            "parsed data snapshot", self.verbose)
+        if saved and self.verbose:
+            print("Saved parsed data snapshot to " + self.snapshot_path)
+
+    def load(self):
+        if not os.path.exists(self.snapshot_path):
+            print("Parsed data snapshot " + self.snapshot_path + " not found. "
+                  + "Run once without --reclassify to create it.")
+            exit(1)
+        try:
+            snapshot = json_backend.load(self.snapshot_path)
+        except Exception as e:
+            print("Failed to load parsed data snapshot " + self.snapshot_path)
+            if self.verbose:
+                print(e)
+            exit(1)
+        key = self.get_key()
+        if snapshot["key"] != key:
+            changed = [name for name in key if snapshot["key"].get(name) != key[name]]
+            print("Parsed data snapshot was created with different parse options ("
+                  + ", ".join(changed) + "). Run without --reclassify to parse again.")
+            exit(1)
+        print("Loaded parsed data snapshot from " + snapshot["created"][:19].replace("T", " "))
+        snapshot["observationsData"] = self.get_observations_data(snapshot)
+        return snapshot
+
+    def get_observations_data(self, snapshot: dict):
+        # Results are classified under the abnormal result options of this run
+        observations_data = ObservationsData()
+        tests = [LabTest.from_stored(test_desc, primary_id, codings)
+                 for test_desc, primary_id, codings in snapshot["tests"]]
+        seen_test_indexes = set()
+        for row in snapshot["observations"]:
+            test_index = row["test_index"]
+            is_seen_test = test_index in seen_test_indexes
+            seen_test_indexes.add(test_index)
+            obs = Observation.from_stored(row, tests[test_index], test_index, is_seen_test,
+                                          self.args.skip_in_range_abnormal_results,
+                                          self.args.in_range_abnormal_boundary)
+            observations_data.add_observation(row["obs_id"], obs)
+        for date, rows in snapshot["vitalSigns"].items():
+            observations_data.observations_vital_signs[date] = [ObservationVital.from_stored(row)
+                                                                for row in rows]
+        observations_data.sort()
+        return observations_data
@@ -0,0 +1,61 @@
+from collections import namedtuple
+from functools import lru_cache
+import re
+
+RANGE_PATTERN = re.compile(r"(\d[\d,]*\.\d+|\d[\d,]+) *(-|–) *(\d[\d,]*\.\d+|\d[\d,]*)")
+ALPHANUMERIC_PATTERN = re.compile("[A-z0-9]")
+NONE_PATTERN = re.compile("^none$", flags=re.IGNORECASE)
+NEGATIVE_PATTERN = re.compile("^negative$", flags=re.IGNORECASE)
+CLEAR_PATTERN = re.compile("^clear$", flags=re.IGNORECASE)
+POSITIVE_PATTERN = re.compile("^positive$", flags=re.IGNORECASE)
+TRACE_PATTERN = re.compile("^trace$", flags=re.IGNORECASE)
+TRACE_OR_SMALL_PATTERN = re.compile("^(trace|small)$", flags=re.IGNORECASE)
+
+RANGE_SPEC_CACHE_SIZE = 4096
+
+# kind is one of:
+#   "range"     numeric lower - upper range
+#   "none"      expected value of none, 0 - 0 or 0 - 1 for percentages
+#   "negative"  expected negative result
+#   "clear"     expected clear result
+#   "text"      any other text, only positive results are abnormal
+# error is the reason the range can't be used, if any, and units_match is
+# whether the range text allows results in the given unit.
+RangeSpec = namedtuple("RangeSpec", ["kind", "lower", "upper", "error", "units_match"])
+
+
+@lru_cache(maxsize=RANGE_SPEC_CACHE_SIZE)
+def parse_range_spec(range_text: str, unit: str):
+    '''
+    Parses a reference range text once for each (range_text, unit) pair, as
+    the same few hundred ranges repeat across all results of an export.
+    '''
+    if (range_text is None
+            or range_text == ""
+            or not ALPHANUMERIC_PATTERN.search(range_text)):
+        return RangeSpec("text", None, None, "Unparsable reference range", False)
+
+    if "not estab" in range_text.lower():
+        return RangeSpec("text", None, None, "Range not established", False)
+
+    units_match = (range_text.lower() == "none"
+                   or range_text.lower() == "clear"
+                   or (unit is not None and unit in range_text))
+
+    # NOTE "high" and "low" objects less consistent than "text" field
+    # so use "text" to set the range
+    value_range_matcher = RANGE_PATTERN.search(range_text)
+    if value_range_matcher:
+        lower = float(value_range_matcher.group(1).replace(",", ""))
+        upper = float(value_range_matcher.group(3).replace(",", ""))
+        if lower > upper:
+            lower, upper = upper, lower
+        return RangeSpec("range", lower, upper, None, units_match)
+    elif NONE_PATTERN.search(range_text):
+        upper = float(1) if (unit is not None and unit == "%") else float(0)
+        return RangeSpec("none", float(0), upper, None, units_match)
+    elif range_text == "NEG" or NEGATIVE_PATTERN.match(range_text):
+        return RangeSpec("negative", None, None, None, units_match)
+    elif CLEAR_PATTERN.match(range_text):
+        return RangeSpec("clear", None, None, None, units_match)
+    return RangeSpec("text", None, None, None, units_match)
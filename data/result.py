@@ -1,31 +1,37 @@
-import re
+import numpy as np
+
+from data.reference_range import parse_range_spec
+from data.reference_range import NEGATIVE_PATTERN, CLEAR_PATTERN, POSITIVE_PATTERN
+from data.reference_range import TRACE_PATTERN, TRACE_OR_SMALL_PATTERN
+from data.units import intern_string
 
 
 class Result:
+    __slots__ = ("range_text", "range_spec", "unit", "is_abnormal", "is_range_type",
+                 "is_binary_type", "interpretation", "range_lower", "range_upper",
+                 "range_span", "range")
+
     def __init__(self, skip_in_range_abnormal_results: bool,
                  abnormal_boundary: float, range_data: list, value,
                  value_string: str, unit: str, check_units_match: bool):
-        self.range_text = range_data[0]["text"]
-        self.range_pat = "(\d[\d,]*\\.\d+|\d[\d,]+) *(-|–) *(\d[\d,]*\.\d+|\d[\d,]*)"
+        self.range_text = intern_string(range_data[0]["text"])
+        self.range_spec = parse_range_spec(self.range_text, unit)
+
+        if self.range_spec.error is not None:
+            raise ValueError(self.range_spec.error)
+
+        self.unit = intern_string(unit)
 
-        if (self.range_text is None
-                or self.range_text == ""
-                or not re.search("[A-z0-9]", self.range_text)):
-            raise ValueError("Unparsable reference range")
+        if check_units_match and not self.range_spec.units_match:
+            raise ValueError("Unmatched units for reference range")
 
-        if "not estab" in self.range_text.lower():
-            raise ValueError("Range not established")
+        self.classify(value, value_string, abnormal_boundary, skip_in_range_abnormal_results)
 
+    def classify(self, value, value_string: str, abnormal_boundary: float,
+                 skip_in_range_abnormal_results: bool):
         self.is_abnormal = False
         self.is_range_type = False
         self.is_binary_type = False
-        self.unit = unit
-
-        if (check_units_match
-            and not (self.range_text.lower() == "none"
-                     or self.range_text.lower() == "clear")
-                and not (self.unit is not None and self.unit in self.range_text)):
-            raise ValueError("Unmatched units for reference range")
 
         if value is not None and not isinstance(value, str):
             self.parse_range_result(
@@ -40,22 +46,10 @@ class Result:
 
     def parse_range_result(self, value, value_string, abnormal_boundary,
                            skip_in_range_abnormal_results):
-        # NOTE "high" and "low" objects less consistent than "text" field
-        # so use "text" to set the range
-        value_range_matcher = re.search(self.range_pat, self.range_text)
-
-        if value_range_matcher:
+        if self.range_spec.kind == "range":
             self.is_range_type = True
-            value1 = value_range_matcher.group(1).replace(",", "")
-            value2 = value_range_matcher.group(3).replace(",", "")
-            self.range_lower = float(value1)
-            self.range_upper = float(value2)
-
-            if self.range_lower > self.range_upper:
-                temp = self.range_upper
-                self.range_upper = self.range_lower
-                self.range_lower = temp
-                temp = None
+            self.range_lower = self.range_spec.lower
+            self.range_upper = self.range_spec.upper
 
             low_out_of_range = value < self.range_lower
             high_out_of_range = value > self.range_upper
@@ -91,45 +85,37 @@ class Result:
                 elif high_out_of_range:
                     self.interpretation = "+++"
 
-        else:
-            none_matcher = re.search(
-                    "^none$", self.range_text, flags=re.IGNORECASE)
-
-            if none_matcher:
-                self.is_binary_type = True
-                self.is_range_type = True
-                self.range_upper = float(1) if (self.unit is not None
-                                                and self.unit == "%") else float(0)
-                self.range_lower = float(0)
-                if value > self.range_upper:
-                    self.is_abnormal = True
-                    self.range = str(self.range_lower) + \
-                        " - " + str(self.range_upper)
-                    self.interpretation = "+"
+        elif self.range_spec.kind == "none":
+            self.is_binary_type = True
+            self.is_range_type = True
+            self.range_upper = self.range_spec.upper
+            self.range_lower = self.range_spec.lower
+            if value > self.range_upper:
+                self.is_abnormal = True
+                self.range = str(self.range_lower) + \
+                    " - " + str(self.range_upper)
+                self.interpretation = "+"
 
     def parse_binary_result(self, value, value_string, abnormal_boundary,
                             skip_in_range_abnormal_results):
-        if self.range_text == "NEG" or re.match(
-                "^negative$", self.range_text, flags=re.IGNORECASE):
-            if not value_string == "NEG" and not re.match(
-                    "^negative$", value_string, flags=re.IGNORECASE):
+        if self.range_spec.kind == "negative":
+            if not value_string == "NEG" and not NEGATIVE_PATTERN.match(value_string):
                 if abnormal_boundary <= 0.1:
-                    if not re.match("^trace$", value_string, flags=re.IGNORECASE):
+                    if not TRACE_PATTERN.match(value_string):
                         self.is_abnormal = True
                 else:
                     self.is_abnormal = True
-        elif (re.match("^clear$", self.range_text, flags=re.IGNORECASE)
-                and not re.match("^clear$", value_string, flags=re.IGNORECASE)):
+        elif (self.range_spec.kind == "clear"
+                and not CLEAR_PATTERN.match(value_string)):
             if abnormal_boundary <= 0.1:
-                if not re.match("^trace$", value_string, flags=re.IGNORECASE):
+                if not TRACE_PATTERN.match(value_string):
                     self.is_abnormal = True
             else:
                 self.is_abnormal = True
-        elif re.match("^positive$", value_string, flags=re.IGNORECASE):
+        elif POSITIVE_PATTERN.match(value_string):
             self.is_abnormal = True
 
-        if skip_in_range_abnormal_results and re.match(
-                "^(trace|small)$", value_string, flags=re.IGNORECASE):
+        if skip_in_range_abnormal_results and TRACE_OR_SMALL_PATTERN.match(value_string):
             self.is_abnormal = False
 
         if self.is_abnormal:
@@ -175,3 +161,36 @@ def get_interpretation_keys(skip_in_range: bool):
         return ["---", "+", "+++"]
     else:
         return ["---", "--", "+", "++", "+++"]
+
+
+def classify_range_values(values, range_lower, range_upper, abnormal_boundary: float,
+                          skip_in_range_abnormal_results: bool):
+    '''
+    Vectorized form of the range classification in Result.parse_range_result.
+    values, range_lower and range_upper are NumPy arrays or scalars that
+    broadcast together, such as all values of a test code against its range.
+    Returns an array of interpretation keys, "" where the value is normal.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    range_lower = np.asarray(range_lower, dtype=np.float64)
+    range_upper = np.asarray(range_upper, dtype=np.float64)
+    range_span = range_upper - range_lower
+    # Results near the range ends are only judged for ranges wider than 0.5
+    wide_range = range_span > 0.5
+    low_out_of_range = values < range_lower
+    high_out_of_range = values > range_upper
+    if abnormal_boundary < 0:
+        # Only values further out than the boundary count on wide ranges
+        low_out_of_range &= ~wide_range
+        high_out_of_range &= ~wide_range
+        skip_in_range_abnormal_results = False
+    if skip_in_range_abnormal_results:
+        low_end_of_range = high_end_of_range = np.zeros(np.shape(values), dtype=bool)
+    else:
+        safe_span = np.where(wide_range, range_span, 1)
+        low_end_of_range = (wide_range & (range_lower != 0) & ~low_out_of_range
+                            & ((values - range_lower) / safe_span < abnormal_boundary))
+        high_end_of_range = (wide_range & ~high_out_of_range
+                             & ((range_upper - values) / safe_span < abnormal_boundary))
+    return np.select([low_out_of_range, low_end_of_range, high_end_of_range, high_out_of_range],
+                     ["---", "--", "++", "+++"], default="")
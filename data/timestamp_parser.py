@@ -0,0 +1,94 @@
+from datetime import date, datetime, timedelta, timezone
+
+APPLE_DATETIME_FORMAT = "%Y-%m-%d %X %z"
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class TimestampParser:
+    '''
+    Decodes timestamps in the fixed format used by Apple Health XML exports,
+    e.g. "2021-03-14 09:26:53 -0500", by slicing the string directly instead
+    of calling strptime. Timezones are cached per offset string and the date
+    part is memoized since many samples share the same day. Any value not in
+    the expected shape falls back to strptime with the configured format.
+    '''
+    def __init__(self, datetime_format=APPLE_DATETIME_FORMAT):
+        self.datetime_format = datetime_format
+        self.is_apple_format = datetime_format == APPLE_DATETIME_FORMAT
+        self.timezones = {}
+        self.offsets = {}
+        self.dates = {}
+
+    def get_date(self, date_str: str):
+        # Returns (year, month, day, ordinal) for a YYYY-MM-DD string
+        if date_str in self.dates:
+            return self.dates[date_str]
+        if date_str[4] != "-" or date_str[7] != "-":
+            raise ValueError("Unexpected date format: " + date_str)
+        _date = date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+        date_parts = (_date.year, _date.month, _date.day, _date.toordinal())
+        self.dates[date_str] = date_parts
+        return date_parts
+
+    def get_offset_seconds(self, offset_str: str):
+        if offset_str in self.offsets:
+            return self.offsets[offset_str]
+        sign = offset_str[0]
+        if sign != "+" and sign != "-":
+            raise ValueError("Unexpected timezone offset: " + offset_str)
+        hours = int(offset_str[1:3])
+        minutes = int(offset_str[3:5])
+        if minutes > 59:
+            raise ValueError("Unexpected timezone offset: " + offset_str)
+        offset_seconds = hours * 3600 + minutes * 60
+        if sign == "-":
+            offset_seconds = -offset_seconds
+        self.offsets[offset_str] = offset_seconds
+        return offset_seconds
+
+    def get_timezone(self, offset_str: str):
+        if offset_str in self.timezones:
+            return self.timezones[offset_str]
+        tzinfo = timezone(timedelta(seconds=self.get_offset_seconds(offset_str)))
+        self.timezones[offset_str] = tzinfo
+        return tzinfo
+
+    def split(self, value: str):
+        # "YYYY-MM-DD HH:MM:SS +HHMM" -> date parts, hour, minute, second, offset string
+        if (not self.is_apple_format or len(value) != 25 or value[10] != " "
+                or value[13] != ":" or value[16] != ":" or value[19] != " "):
+            raise ValueError("Unexpected timestamp format: " + value)
+        hour = int(value[11:13])
+        minute = int(value[14:16])
+        second = int(value[17:19])
+        if hour > 23 or minute > 59 or second > 61:
+            raise ValueError("Unexpected timestamp format: " + value)
+        return self.get_date(value[0:10]), hour, minute, second, value[20:25]
+
+    def parse(self, value: str):
+        try:
+            date_parts, hour, minute, second, offset_str = self.split(value)
+            return datetime(date_parts[0], date_parts[1], date_parts[2],
+                            hour, minute, second, tzinfo=self.get_timezone(offset_str))
+        except (ValueError, IndexError):
+            return datetime.strptime(value, self.datetime_format)
+
+    def parse_epoch(self, value: str):
+        # (year, UTC epoch seconds, UTC offset seconds) without building a datetime
+        try:
+            date_parts, hour, minute, second, offset_str = self.split(value)
+            offset_seconds = self.get_offset_seconds(offset_str)
+            return (date_parts[0], (date_parts[3] - EPOCH_ORDINAL) * 86400 + hour * 3600
+                    + minute * 60 + second - offset_seconds, offset_seconds)
+        except (ValueError, IndexError):
+            return get_epoch(datetime.strptime(value, self.datetime_format))
+
+
+def get_epoch(time: datetime):
+    # (year, UTC epoch seconds, UTC offset seconds) for a datetime
+    offset = time.utcoffset()
+    return time.year, int(time.timestamp()), 0 if offset is None else int(offset.total_seconds())
+
+
+def get_local_ordinal(epoch: int, offset: int):
+    return (epoch + offset) // 86400 + EPOCH_ORDINAL
@@ -1,5 +1,6 @@
 from datetime import datetime
 from enum import Enum
+import sys
 
 
 class VitalSignCategory(Enum):
@@ -129,8 +130,8 @@ def calculate_bmi(normalized_height: float, normalized_weight: float,
 
 base_stats = {
     "count": 0,
-    "sum": 0,
     "avg": None,
+    "m2": 0,
     "max": None,
     "min": None,
     "mostRecent": None,
@@ -138,37 +139,117 @@ base_stats = {
     "list": []}
 
 
-def set_stats(stats: dict, time, value):
-    if time is None:
-        stats["list"].append(value)
-    else:
-        stats["list"].append({"time": time, "value": value})
-    stats["count"] += 1
+def set_moments(stats: dict, value):
+    # Welford's online update of the running mean and sum of squared
+    # differences from the mean (M2) - stats["count"] must already include value
+    count = stats["count"]
     if type(value) == list:
         for i in range(len(value)):
             c_value = value[i]
-            stats["sum"][i] += c_value
-            if stats["max"][i] is None:
+            if count == 1:
+                stats["avg"][i] = c_value
                 stats["max"][i] = c_value
                 stats["min"][i] = c_value
-            elif stats["max"][i] < c_value:
+                continue
+            delta = c_value - stats["avg"][i]
+            stats["avg"][i] += delta / count
+            stats["m2"][i] += delta * (c_value - stats["avg"][i])
+            if stats["max"][i] < c_value:
                 stats["max"][i] = c_value
             elif stats["min"][i] > c_value:
                 stats["min"][i] = c_value
+    elif count == 1:
+        stats["avg"] = value
+        stats["max"] = value
+        stats["min"] = value
     else:
-        stats["sum"] += value
-        if stats["max"] is None:
-            stats["max"] = value
-            stats["min"] = value
-        elif stats["max"] < value:
+        delta = value - stats["avg"]
+        stats["avg"] += delta / count
+        stats["m2"] += delta * (value - stats["avg"])
+        if stats["max"] < value:
             stats["max"] = value
         elif stats["min"] > value:
             stats["min"] = value
 
 
+def new_moments():
+    # Running moments alone, for stats grouped by day or minute
+    return {"count": 0, "avg": None, "m2": 0, "max": None, "min": None}
+
+
+def add_moments(moments: dict, value):
+    moments["count"] += 1
+    set_moments(moments, value)
+
+
+def set_stats(stats: dict, epoch: int, offset: int, value, motion=0):
+    # stats["list"] is a VitalSeries, or VitalAggregates when raw samples are not kept.
+    # Times are UTC epoch seconds with the original UTC offset in seconds alongside.
+    stats["list"].append_epoch(epoch, offset, value, motion)
+    stats["count"] += 1
+    set_moments(stats, value)
+
+
+def merge_extreme(value, other_value, extreme_func):
+    if value is None:
+        return other_value
+    elif other_value is None:
+        return value
+    return extreme_func(value, other_value)
+
+
+def merge_moments(count, avg, m2, other_count, other_avg, other_m2):
+    # Chan et al. pairwise combination of two sets of running moments
+    if count == 0:
+        return other_avg, other_m2
+    elif other_count == 0:
+        return avg, m2
+    total = count + other_count
+    delta = other_avg - avg
+    return (avg + delta * other_count / total,
+            m2 + other_m2 + delta * delta * count * other_count / total)
+
+
+def merge_stats_moments(stats: dict, other_stats: dict):
+    count = stats["count"]
+    other_count = other_stats["count"]
+    if type(stats["m2"]) == list:
+        for i in range(len(stats["m2"])):
+            stats["avg"][i], stats["m2"][i] = merge_moments(
+                count, stats["avg"][i], stats["m2"][i],
+                other_count, other_stats["avg"][i], other_stats["m2"][i])
+            stats["max"][i] = merge_extreme(stats["max"][i], other_stats["max"][i], max)
+            stats["min"][i] = merge_extreme(stats["min"][i], other_stats["min"][i], min)
+    else:
+        stats["avg"], stats["m2"] = merge_moments(
+            count, stats["avg"], stats["m2"], other_count, other_stats["avg"], other_stats["m2"])
+        stats["max"] = merge_extreme(stats["max"], other_stats["max"], max)
+        stats["min"] = merge_extreme(stats["min"], other_stats["min"], min)
+    stats["count"] = count + other_count
+
+
+def merge_stats(stats: dict, other_stats: dict):
+    # Combine stats built by set_stats over a separate set of observations
+    stats["list"].extend(other_stats["list"])
+    merge_stats_moments(stats, other_stats)
+
+
+def get_stdev(stats: dict):
+    # Population standard deviation from the running moments
+    if type(stats["m2"]) == list:
+        return [(m2 / stats["count"]) ** (1/2) for m2 in stats["m2"]]
+    return (stats["m2"] / stats["count"]) ** (1/2)
+
+
 def get_age(birth_date):
     today = datetime.today()
     age = today.year - birth_date.year
     test_date = datetime(today.year, birth_date.month, birth_date.day, 0, 0, 0)
     age += round((today - test_date).days / 365, 1)
-    return age
\ No newline at end of file
+    return age
+
+
+def intern_string(value):
+    # Codes, dates and units repeat across thousands of observations, so
+    # share one copy of each. Values that are not strings pass through.
+    return sys.intern(value) if type(value) == str else value
@@ -0,0 +1,212 @@
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from data.timestamp_parser import EPOCH_ORDINAL
+from data.units import base_stats, new_moments, add_moments, merge_stats_moments
+
+MOMENT_FIELDS = ["count", "avg", "m2", "max", "min"]
+MINUTES_PER_DAY = 60 * 24
+
+
+def group_stats(keys, values):
+    # Build a base stats dict of running moments per distinct key from parallel
+    # arrays of keys and values, in a single vectorized pass over the values
+    grouped = {}
+    if len(keys) == 0:
+        return grouped
+    unique_keys, first_indices, inverse, counts = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True)
+    # Sums of differences from the first value of each group are exact enough
+    # to give M2 without a second pass over the values for the group mean
+    shifts = values[first_indices]
+    deltas = values - shifts[inverse]
+    delta_sums = np.bincount(inverse, deltas, len(unique_keys))
+    delta_sq_sums = np.bincount(inverse, deltas * deltas, len(unique_keys))
+    avgs = shifts + delta_sums / counts
+    m2s = np.maximum(delta_sq_sums - delta_sums * delta_sums / counts, 0)
+    maxs = np.full(len(unique_keys), -np.inf)
+    mins = np.full(len(unique_keys), np.inf)
+    np.maximum.at(maxs, inverse, values)
+    np.minimum.at(mins, inverse, values)
+    for i, key in enumerate(unique_keys.tolist()):
+        stats = deepcopy(base_stats)
+        stats["count"] = int(counts[i])
+        stats["avg"] = float(avgs[i])
+        stats["m2"] = float(m2s[i])
+        stats["max"] = float(maxs[i])
+        stats["min"] = float(mins[i])
+        grouped[key] = stats
+    return grouped
+
+
+def moments_to_arrays(grouped_moments: dict):
+    keys = np.array(list(grouped_moments.keys()), dtype=np.int64)
+    values = np.array([[np.nan if moments[field] is None else moments[field] for field in MOMENT_FIELDS]
+                       for moments in grouped_moments.values()], dtype=np.float64).reshape(-1, len(MOMENT_FIELDS))
+    return keys, values
+
+
+def moments_from_arrays(keys, values):
+    grouped_moments = {}
+    for key, row in zip(keys.tolist(), values.tolist()):
+        moments = new_moments()
+        moments["count"] = int(row[0])
+        for field, value in zip(MOMENT_FIELDS[1:], row[1:]):
+            moments[field] = None if np.isnan(value) else value
+        grouped_moments[key] = moments
+    return grouped_moments
+
+
+class VitalAggregates:
+    '''
+    Stands in for a VitalSeries as the "list" entry of a vitals stats dict when
+    raw samples are not needed. Each sample is folded into running moments per
+    local date and, for pulse, per minute of the day along with the motion,
+    resting and pulse spike tallies VitalsStatsGraph reports, then discarded.
+    Memory use depends on the number of days covered, not the sample count.
+    '''
+    def __init__(self, value_width=1, has_motion=False, track_minutes=False):
+        self.value_width = value_width
+        self.has_motion = has_motion
+        self.track_minutes = track_minutes
+        self.size = 0
+        self.days = {}
+        self.minutes = {}
+        self.motion_minutes = {}
+        self.spikes = np.zeros(MINUTES_PER_DAY, dtype=np.int64)
+        self.in_motion = new_moments()
+        self.resting = new_moments()
+        self.first_minute = None
+        self.first_value = None
+        self.previous_minute = None
+        self.previous_value = None
+        self.most_recent = None
+
+    def __len__(self):
+        return self.size
+
+    def append_epoch(self, epoch: int, offset: int, value, motion=0):
+        self.size += 1
+        # Ties go to the later sample, as with a stable sort by time
+        if self.value_width != 1:
+            if self.most_recent is None or epoch >= self.most_recent[0]:
+                self.most_recent = (epoch, offset, [float(v) for v in value], motion)
+            return
+        if self.most_recent is None or epoch >= self.most_recent[0]:
+            self.most_recent = (epoch, offset, float(value), motion)
+        local_seconds = epoch + offset
+        ordinal = local_seconds // 86400 + EPOCH_ORDINAL
+        if ordinal not in self.days:
+            self.days[ordinal] = new_moments()
+        add_moments(self.days[ordinal], value)
+        if not self.track_minutes:
+            return
+        minute = (local_seconds % 86400) // 60
+        if minute not in self.minutes:
+            self.minutes[minute] = new_moments()
+            self.motion_minutes[minute] = new_moments()
+        add_moments(self.minutes[minute], value)
+        add_moments(self.motion_minutes[minute], motion)
+        if motion > 0 or value > 105:
+            add_moments(self.in_motion, value)
+        else:
+            add_moments(self.resting, value)
+        # Spikes are judged against the previously ingested reading, which
+        # matches time order as long as the export lists readings in order
+        self.count_spike(self.previous_minute, self.previous_value, minute, value)
+        if self.first_minute is None:
+            self.first_minute = minute
+            self.first_value = value
+        self.previous_minute = minute
+        self.previous_value = value
+
+    def count_spike(self, previous_minute, previous_value, minute, value):
+        if (previous_minute is not None and minute - previous_minute < 5
+                and value - previous_value > 40):
+            self.spikes[previous_minute] += 1
+
+    def extend(self, other):
+        self.size += other.size
+        for grouped_moments, other_grouped_moments in [(self.days, other.days),
+                                                       (self.minutes, other.minutes),
+                                                       (self.motion_minutes, other.motion_minutes)]:
+            for key, other_moments in other_grouped_moments.items():
+                if key not in grouped_moments:
+                    grouped_moments[key] = new_moments()
+                merge_stats_moments(grouped_moments[key], other_moments)
+        self.spikes += other.spikes
+        # The first reading of the following chunk is compared with the last
+        # reading of this one, as if both were ingested in a single pass
+        if other.first_minute is not None:
+            self.count_spike(self.previous_minute, self.previous_value,
+                             other.first_minute, other.first_value)
+        if self.first_minute is None:
+            self.first_minute = other.first_minute
+            self.first_value = other.first_value
+        merge_stats_moments(self.in_motion, other.in_motion)
+        merge_stats_moments(self.resting, other.resting)
+        if other.previous_minute is not None:
+            self.previous_minute = other.previous_minute
+            self.previous_value = other.previous_value
+        if other.most_recent is not None and (self.most_recent is None
+                or other.most_recent[0] >= self.most_recent[0]):
+            self.most_recent = other.most_recent
+
+    def sort(self):
+        # Nothing to order once samples are aggregated
+        pass
+
+    def get_most_recent(self):
+        if self.most_recent is None:
+            return None
+        epoch, offset, value, motion = self.most_recent
+        most_recent = {"time": datetime.fromtimestamp(epoch, timezone(timedelta(seconds=offset))),
+                       "value": value}
+        if self.has_motion:
+            most_recent["motion"] = motion
+        return most_recent
+
+    def to_arrays(self):
+        arrays = {}
+        arrays["day_keys"], arrays["day_moments"] = moments_to_arrays(self.days)
+        if self.track_minutes:
+            arrays["minute_keys"], arrays["minute_moments"] = moments_to_arrays(self.minutes)
+            _, arrays["motion_minute_moments"] = moments_to_arrays(self.motion_minutes)
+            _, arrays["motion_moments"] = moments_to_arrays({0: self.in_motion, 1: self.resting})
+            arrays["spikes"] = self.spikes
+            if self.first_minute is not None:
+                arrays["edge_minutes"] = np.array([self.first_minute, self.previous_minute], dtype=np.int64)
+                arrays["edge_values"] = np.array([self.first_value, self.previous_value], dtype=np.float64)
+        arrays["size"] = np.array([self.size, self.value_width, int(self.has_motion)], dtype=np.int64)
+        if self.most_recent is not None:
+            epoch, offset, value, motion = self.most_recent
+            arrays["most_recent_time"] = np.array([epoch, offset, motion], dtype=np.int64)
+            arrays["most_recent_value"] = np.array(value, dtype=np.float64)
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays: dict):
+        size, value_width, has_motion = arrays["size"].tolist()
+        aggregates = VitalAggregates(value_width, bool(has_motion), "minute_keys" in arrays)
+        aggregates.size = size
+        aggregates.days = moments_from_arrays(arrays["day_keys"], arrays["day_moments"])
+        if "most_recent_time" in arrays:
+            epoch, offset, motion = arrays["most_recent_time"].tolist()
+            aggregates.most_recent = (epoch, offset, arrays["most_recent_value"].tolist(), motion)
+        if aggregates.track_minutes:
+            aggregates.minutes = moments_from_arrays(arrays["minute_keys"], arrays["minute_moments"])
+            aggregates.motion_minutes = moments_from_arrays(arrays["minute_keys"],
+                                                            arrays["motion_minute_moments"])
+            motion_moments = moments_from_arrays(np.arange(2), arrays["motion_moments"])
+            aggregates.in_motion = motion_moments[0]
+            aggregates.resting = motion_moments[1]
+            aggregates.spikes = arrays["spikes"].astype(np.int64)
+            if "edge_minutes" in arrays:
+                aggregates.first_minute, aggregates.previous_minute = arrays["edge_minutes"].tolist()
+                aggregates.first_value, aggregates.previous_value = arrays["edge_values"].tolist()
+        return aggregates
+
+    def to_dict_list(self):
+        return []
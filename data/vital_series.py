@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from data.timestamp_parser import EPOCH_ORDINAL
+
+INITIAL_CAPACITY = 1024
+
+
+class VitalSeries:
+    '''
+    Compact columnar store for timestamped vital sign samples, used as the
+    "list" entry of each vitals stats dict. Times are held as UTC epoch seconds
+    alongside the original UTC offset so local dates and times can still be
+    recovered. Indexing or iterating returns the same {"time", "value"} dicts
+    (plus "motion" where tracked) the stats lists used to hold.
+    '''
+    def __init__(self, value_width=1, has_motion=False):
+        self.value_width = value_width
+        self.has_motion = has_motion
+        self.size = 0
+        self.epochs = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.offsets = np.empty(INITIAL_CAPACITY, dtype=np.int32)
+        if value_width == 1:
+            self.values = np.empty(INITIAL_CAPACITY, dtype=np.float32)
+        else:
+            self.values = np.empty((INITIAL_CAPACITY, value_width), dtype=np.float32)
+        self.motion = np.zeros(INITIAL_CAPACITY, dtype=np.uint8) if has_motion else None
+        self.timezones = {}
+        # Ties go to the later sample, as with a stable sort by time
+        self.most_recent_index = None
+        self.most_recent_epoch = None
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError("VitalSeries index out of range")
+        obs = {"time": self.get_time(index), "value": self.get_value(index)}
+        if self.has_motion:
+            obs["motion"] = int(self.motion[index])
+        return obs
+
+    def __getstate__(self):
+        # Drop unused capacity when pickling for worker processes or copying
+        state = self.__dict__.copy()
+        state["epochs"] = self.epochs[:self.size].copy()
+        state["offsets"] = self.offsets[:self.size].copy()
+        state["values"] = self.values[:self.size].copy()
+        if self.has_motion:
+            state["motion"] = self.motion[:self.size].copy()
+        return state
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def grow(self, min_capacity):
+        capacity = max(min_capacity, len(self.epochs) * 2)
+        self.epochs = np.resize(self.epochs, capacity)
+        self.offsets = np.resize(self.offsets, capacity)
+        if self.value_width == 1:
+            self.values = np.resize(self.values, capacity)
+        else:
+            self.values = np.resize(self.values, (capacity, self.value_width))
+        if self.has_motion:
+            motion = np.zeros(capacity, dtype=np.uint8)
+            motion[:self.size] = self.motion[:self.size]
+            self.motion = motion
+
+    def append_epoch(self, epoch: int, offset: int, value, motion=0):
+        if self.size == len(self.epochs):
+            self.grow(self.size + 1)
+        if self.most_recent_epoch is None or epoch >= self.most_recent_epoch:
+            self.most_recent_index = self.size
+            self.most_recent_epoch = epoch
+        self.epochs[self.size] = epoch
+        self.offsets[self.size] = offset
+        self.values[self.size] = value
+        if self.has_motion:
+            self.motion[self.size] = motion
+        self.size += 1
+
+    def extend(self, other):
+        new_size = self.size + other.size
+        if new_size > len(self.epochs):
+            self.grow(new_size)
+        self.epochs[self.size:new_size] = other.epochs[:other.size]
+        self.offsets[self.size:new_size] = other.offsets[:other.size]
+        self.values[self.size:new_size] = other.values[:other.size]
+        if self.has_motion:
+            if other.has_motion:
+                self.motion[self.size:new_size] = other.motion[:other.size]
+            else:
+                self.motion[self.size:new_size] = 0
+        if other.most_recent_epoch is not None and (self.most_recent_epoch is None
+                or other.most_recent_epoch >= self.most_recent_epoch):
+            self.most_recent_index = self.size + other.most_recent_index
+            self.most_recent_epoch = other.most_recent_epoch
+        self.size = new_size
+
+    def sort(self):
+        # Stable sort by time. Samples from each source arrive mostly in order,
+        # so this is usually a no-op check, and otherwise the stable argsort
+        # (timsort) merges the already sorted runs rather than sorting afresh.
+        epochs = self.epochs[:self.size]
+        if np.all(epochs[1:] >= epochs[:-1]):
+            return
+        order = np.argsort(epochs, kind="stable")
+        self.epochs[:self.size] = self.epochs[:self.size][order]
+        self.offsets[:self.size] = self.offsets[:self.size][order]
+        self.values[:self.size] = self.values[:self.size][order]
+        if self.has_motion:
+            self.motion[:self.size] = self.motion[:self.size][order]
+        self.most_recent_index = self.size - 1
+
+    def get_timezone(self, offset: int):
+        if offset not in self.timezones:
+            self.timezones[offset] = timezone(timedelta(seconds=offset))
+        return self.timezones[offset]
+
+    def get_time(self, index: int):
+        return datetime.fromtimestamp(int(self.epochs[index]),
+                                      self.get_timezone(int(self.offsets[index])))
+
+    def get_most_recent(self):
+        if self.most_recent_index is None:
+            return None
+        return self[self.most_recent_index]
+
+    def get_value(self, index: int):
+        # Values are stored as float32 - round trip through the shortest float32
+        # representation so a stored 72.6 comes back as 72.6
+        if self.value_width == 1:
+            return float(str(self.values[index]))
+        return [float(str(value)) for value in self.values[index]]
+
+    def get_values(self):
+        return self.values[:self.size].astype(np.float64)
+
+    def get_motion(self):
+        if self.has_motion:
+            return self.motion[:self.size]
+        return np.zeros(self.size, dtype=np.uint8)
+
+    def get_local_seconds(self):
+        return self.epochs[:self.size] + self.offsets[:self.size]
+
+    def get_local_ordinals(self):
+        return self.get_local_seconds() // 86400 + EPOCH_ORDINAL
+
+    def get_local_minutes(self):
+        return (self.get_local_seconds() % 86400) // 60
+
+    def to_arrays(self):
+        arrays = {"epochs": self.epochs[:self.size], "offsets": self.offsets[:self.size],
+                  "values": self.values[:self.size]}
+        if self.has_motion:
+            arrays["motion"] = self.motion[:self.size]
+        return arrays
+
+    @staticmethod
+    def from_arrays(epochs, offsets, values, motion=None):
+        value_width = 1 if values.ndim == 1 else values.shape[1]
+        series = VitalSeries(value_width, motion is not None)
+        series.size = len(epochs)
+        series.epochs = epochs.astype(np.int64)
+        series.offsets = offsets.astype(np.int32)
+        series.values = values.astype(np.float32)
+        if motion is not None:
+            series.motion = motion.astype(np.uint8)
+        if series.size > 0:
+            # Last occurrence of the latest time
+            series.most_recent_index = series.size - 1 - int(np.argmax(series.epochs[::-1]))
+            series.most_recent_epoch = int(series.epochs[series.most_recent_index])
+        return series
+
+    def to_dict_list(self):
+        return [self[i] for i in range(self.size)]
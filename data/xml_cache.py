@@ -0,0 +1,127 @@
+from datetime import datetime
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from data.atomic_save import save_atomic
+from data.units import get_age
+from data.vital_aggregates import VitalAggregates
+from data.vital_series import VitalSeries
+
+XML_CACHE_VERSION = 4
+HASH_SAMPLE_COUNT = 64
+HASH_SAMPLE_SIZE = 1 << 16
+
+# AppleHealthXMLData attributes holding vitals stats dicts
+XML_DATA_STATS = ["blood_pressure_stats", "bmi_stats", "height_stats", "hrv_stats",
+                  "pulse_stats", "respiration_stats", "spo2_stats", "stand_stats",
+                  "step_stats", "temperature_stats", "weight_stats"]
+XML_DATA_ATTRIBUTES = ["xml_vitals_observations_count", "blood_pressure_stats_preset",
+                       "motion_data_found", "min_xml_ordinal", "birth_date"]
+SUBJECT_KEYS = ["sex", "bloodType"]
+
+
+def get_content_hash(file_path: str, file_size: int):
+    # Hashing a multi-GB export in full would cost more than a cache hit saves,
+    # so hash evenly spaced samples along with the start and end of the file.
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        if file_size <= HASH_SAMPLE_COUNT * HASH_SAMPLE_SIZE:
+            content_hash.update(f.read())
+        else:
+            step = (file_size - HASH_SAMPLE_SIZE) // (HASH_SAMPLE_COUNT - 1)
+            for i in range(HASH_SAMPLE_COUNT):
+                f.seek(i * step)
+                content_hash.update(f.read(HASH_SAMPLE_SIZE))
+    return content_hash.hexdigest()
+
+
+class XMLParseCache:
+    '''
+    Stores the vitals parsed from export.xml as a compressed .npz file so later
+    runs over the same export with the same parse options skip XML parsing.
+    '''
+    def __init__(self, cache_path: str, export_xml_file_path: str, args):
+        self.cache_path = cache_path
+        self.export_xml_file_path = export_xml_file_path
+        self.args = args
+        self.verbose = args.verbose
+        self.key = None
+
+    def get_key(self):
+        if self.key is None:
+            stat = os.stat(self.export_xml_file_path)
+            self.key = {
+                "version": XML_CACHE_VERSION,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "contentHash": get_content_hash(self.export_xml_file_path, stat.st_size),
+                "startYear": self.args.start_year,
+                "aggregatesOnly": self.args.aggregates_only,
+                "datetimeFormat": self.args.datetime_format,
+                "normalHeightUnit": self.args.normal_height_unit.name,
+                "normalWeightUnit": self.args.normal_weight_unit.name,
+                "normalTemperatureUnit": self.args.normal_temperature_unit.name}
+        return self.key
+
+    def load(self, xml_data, subject: dict):
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                meta = json.loads(str(cache["meta"]))
+                if meta["key"] != self.get_key():
+                    if self.verbose:
+                        print("XML parse cache is out of date, parsing export.xml")
+                    return False
+                for name in XML_DATA_STATS:
+                    stats = getattr(xml_data, name)
+                    # Update in place so vitals_stats_list still holds the same dicts
+                    stats.clear()
+                    stats.update(meta["stats"][name])
+                    if self.args.aggregates_only:
+                        prefix = name + "_"
+                        stats["list"] = VitalAggregates.from_arrays(
+                            {key[len(prefix):]: cache[key] for key in cache.files if key.startswith(prefix)})
+                    else:
+                        motion = cache[name + "_motion"] if name + "_motion" in cache else None
+                        stats["list"] = VitalSeries.from_arrays(
+                            cache[name + "_epochs"], cache[name + "_offsets"],
+                            cache[name + "_values"], motion)
+            for attribute in XML_DATA_ATTRIBUTES:
+                setattr(xml_data, attribute, meta["attributes"][attribute])
+            if "birthDate" not in subject and xml_data.birth_date is not None:
+                subject["birthDate"] = xml_data.birth_date
+                subject["age"] = get_age(datetime.fromisoformat(xml_data.birth_date))
+            for key in SUBJECT_KEYS:
+                if key in meta["subject"]:
+                    subject[key] = meta["subject"][key]
+        except Exception as e:
+            print("WARNING: Failed to load XML parse cache, parsing export.xml")
+            if self.verbose:
+                print(e)
+            return False
+        print("Loaded parsed export.xml data from cache " + self.cache_path)
+        return True
+
+    def save(self, xml_data, subject: dict):
+        arrays = {}
+        meta = {"key": self.get_key(), "stats": {}, "attributes": {}, "subject": {}}
+        for name in XML_DATA_STATS:
+            stats = getattr(xml_data, name)
+            meta["stats"][name] = {key: value for key, value in stats.items() if key != "list"}
+            for array_name, array in stats["list"].to_arrays().items():
+                arrays[name + "_" + array_name] = array
+        for attribute in XML_DATA_ATTRIBUTES:
+            meta["attributes"][attribute] = getattr(xml_data, attribute)
+        for key in SUBJECT_KEYS:
+            if key in subject:
+                meta["subject"][key] = subject[key]
+        arrays["meta"] = np.array(json.dumps(meta))
+        # numpy adds .npz to paths without it
+        saved = save_atomic(self.cache_path, lambda path: np.savez_compressed(path, **arrays),
+                            "XML parse cache", self.verbose, temp_suffix=".tmp.npz")
+        if saved and self.verbose:
+            print("Saved parsed export.xml data to cache " + self.cache_path)
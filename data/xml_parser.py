@@ -1,23 +1,36 @@
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from datetime import datetime
+import os
 import xml.etree.ElementTree as ET
 
+from data.timestamp_parser import TimestampParser, get_local_ordinal
+from data.xml_prefilter import XMLRecordTypeFilter
+from data.vital_aggregates import VitalAggregates
+from data.vital_series import VitalSeries
 from data.units import VitalSignCategory, HeightUnit, WeightUnit, TemperatureUnit
-from data.units import convert, get_age, base_stats, set_stats
+from data.units import convert, get_age, base_stats, set_stats, merge_stats
+
+XML_READ_BLOCK_SIZE = 1 << 20
+XML_CHUNKS_PER_WORKER = 4
+# Apple writes direct children of HealthData with a single space of indentation,
+# while records nested inside a Correlation are indented further.
+XML_CHUNK_BOUNDARY_MARKERS = [b"\n <Record ", b"\n <Correlation "]
 
 
 class AppleHealthXMLData:
-    def __init__(self, normal_height_unit, normal_weight_unit):
+    def __init__(self, normal_height_unit, normal_weight_unit, aggregates_only=False):
+        self.aggregates_only = aggregates_only
         self.blood_pressure_stats = {
             "vital": VitalSignCategory.BLOOD_PRESSURE.value, "count": 0,
             "labels": ["BP Systolic", "BP Diastolic"],
-            "sum": [0, 0],
             "avg": [None, None],
+            "m2": [0, 0],
             "max": [None, None],
             "min": [None, None],
-            "mostRecent": [None, None],
+            "mostRecent": None,
             "unit": "mmHg",
-            "list": []}
+            "list": self.new_series(value_width=2)}
         self.bmi_stats = deepcopy(base_stats)
         self.height_stats = deepcopy(base_stats)
         self.hrv_stats = deepcopy(base_stats)
@@ -44,9 +57,16 @@ class AppleHealthXMLData:
         self.temperature_stats["vital"] = VitalSignCategory.TEMPERATURE.value
         self.weight_stats["vital"] = VitalSignCategory.WEIGHT.value
         self.weight_stats["unit"] = normal_weight_unit.name.lower()
+        self.pulse_stats["list"] = self.new_series(has_motion=True)
+        for stats in [self.bmi_stats, self.height_stats, self.hrv_stats, self.respiration_stats,
+                      self.spo2_stats, self.stand_stats, self.step_stats, self.temperature_stats,
+                      self.weight_stats]:
+            stats["list"] = self.new_series()
         self.xml_vitals_observations_count = 0
         self.blood_pressure_stats_preset = False
         self.motion_data_found = False
+        self.min_xml_ordinal = 99999999
+        self.birth_date = None
 
         self.vitals_stats_list = [
             self.height_stats, self.weight_stats, self.bmi_stats,
@@ -54,27 +74,35 @@ class AppleHealthXMLData:
             self.blood_pressure_stats, self.hrv_stats, self.stand_stats, self.step_stats]
 
 
-    def set_observations_count(self, blood_pressure_count, heart_rate_count):
-        self.xml_vitals_observations_count = (blood_pressure_count + heart_rate_count
-            + self.hrv_stats["count"] + self.temperature_stats["count"])
+    def new_series(self, value_width=1, has_motion=False):
+        if self.aggregates_only:
+            # Pulse is the only vital graphed by minute of the day
+            return VitalAggregates(value_width, has_motion, track_minutes=has_motion)
+        return VitalSeries(value_width, has_motion)
+
+    def merge(self, other):
+        # Combine stats collected from a separately parsed chunk of the export
+        for stats, other_stats in zip(self.vitals_stats_list, other.vitals_stats_list):
+            merge_stats(stats, other_stats)
+        self.motion_data_found = self.motion_data_found or other.motion_data_found
+        self.min_xml_ordinal = min(self.min_xml_ordinal, other.min_xml_ordinal)
+        if other.birth_date is not None:
+            self.birth_date = other.birth_date
 
-    def finalize(self, verbose,
-            blood_pressure_observations, blood_pressure_count, blood_pressure_sums,
-            heart_rate_observations, heart_rate_count, heart_rate_sum):
+    def set_observations_count(self):
+        self.xml_vitals_observations_count = (self.blood_pressure_stats["count"]
+            + self.pulse_stats["count"] + self.hrv_stats["count"] + self.temperature_stats["count"])
 
+    def finalize(self, verbose):
         if self.blood_pressure_stats["count"] > 0:
             self.blood_pressure_stats_preset = True
             if verbose:
-                print("Found " + str(len(blood_pressure_observations))
+                print("Found " + str(self.blood_pressure_stats["count"])
                             + " blood pressure observations in XML data.")
-            self.blood_pressure_stats["count"] = blood_pressure_count
-            self.blood_pressure_stats["sum"] = blood_pressure_sums
         if self.pulse_stats["count"] > 0:
             if verbose:
-                print("Found " + str(len(heart_rate_observations))
+                print("Found " + str(self.pulse_stats["count"])
                         + " heart rate observations in XML data.")
-            self.pulse_stats["count"] = heart_rate_count
-            self.pulse_stats["sum"] = heart_rate_sum
         if verbose:
             if self.height_stats["count"] > 0:
                 print("Found " + str(self.height_stats["count"])
@@ -100,7 +128,21 @@ class AppleHealthXMLData:
 
 
 class AppleHealthXMLParser:
-    min_xml_ordinal = 99999999
+    # Element type attribute -> name of the method handling it. Elements with
+    # types not present here are skipped without further inspection.
+    correlation_handlers = {
+        "HKCorrelationTypeIdentifierBloodPressure": "handle_blood_pressure",
+    }
+    record_handlers = {
+        "HKQuantityTypeIdentifierHeight": "handle_height",
+        "HKQuantityTypeIdentifierBodyMass": "handle_body_mass",
+        "HKQuantityTypeIdentifierHeartRate": "handle_heart_rate",
+        "HKQuantityTypeIdentifierHeartRateVariabilitySDNN": "handle_hrv",
+        "HKQuantityTypeIdentifierOxygenSaturation": "handle_spo2",
+        "HKQuantityTypeIdentifierAppleStandTime": "handle_stand",
+        "HKQuantityTypeIdentifierStepCount": "handle_steps",
+        "HKQuantityTypeIdentifierBodyTemperature": "handle_temperature",
+    }
 
     def __init__(self, apple_health_data, args):
         self.data = apple_health_data
@@ -110,230 +152,330 @@ class AppleHealthXMLParser:
         self.normal_weight_unit = args.normal_weight_unit
         self.normal_temperature_unit = args.normal_temperature_unit
         self.datetime_format = args.datetime_format
+        self.timestamp_parser = TimestampParser(self.datetime_format)
         self.start_year = args.start_year
+        self.workers = args.workers
+        self.record_type_filter = None
+        if args.xml_prefilter:
+            self.record_type_filter = XMLRecordTypeFilter(AppleHealthXMLParser.record_handlers.keys())
+        self.args = args
+        self.handlers = {"Correlation": {}, "Record": {}}
+        for rec_type, handler_name in AppleHealthXMLParser.correlation_handlers.items():
+            self.handlers["Correlation"][rec_type] = getattr(self, handler_name)
+        for rec_type, handler_name in AppleHealthXMLParser.record_handlers.items():
+            self.handlers["Record"][rec_type] = getattr(self, handler_name)
 
-    def parse(self, export_xml_file_path):
+    def parse(self, export_xml_file_path, export_zip=None):
         print("Parsing XML...")
         try:
-            tree = ET.parse(export_xml_file_path)
-            root = tree.getroot()
-            me = root.find("Me").attrib
-            if "birthDate" not in self.subject:
-                birth_date_str = me["HKCharacteristicTypeIdentifierDateOfBirth"]
-                birth_date = datetime.fromisoformat(birth_date_str)
-                self.subject["birthDate"] = birth_date_str
-                self.subject["age"] = get_age(birth_date)
-            self.subject["sex"] = me["HKCharacteristicTypeIdentifierBiologicalSex"].replace(
-                "HKBiologicalSex", "")
-            self.subject["bloodType"] = me["HKCharacteristicTypeIdentifierBloodType"].replace(
-                "HKBloodType", "")
-            blood_pressure_observations = []
-            blood_pressure_sums = [0, 0]
-            blood_pressure_count = 0
-            blood_pressure_max = [None, None]
-            blood_pressure_min = [None, None]
-            heart_rate_observations = []
-            heart_rate_sum = 0
-            heart_rate_count = 0
-            heart_rate_max = None
-            heart_rate_min = None
-
-            for correlation in root.iter("Correlation"):
-                if "type" not in correlation.attrib:
-                    continue
-                if correlation.attrib["type"] == "HKCorrelationTypeIdentifierBloodPressure":
-                    if "startDate" in correlation.attrib:
-                        try:
-                            time = datetime.strptime(
-                                correlation.attrib["startDate"], self.datetime_format)
-                        except Exception:
-                            if self.verbose:
-                                print(
-                                    "Exception on constructing date from XML observation")
-                        if self.start_year is not None and self.start_year > time.year:
-                            continue
-                    else:
-                        continue
-
-                    blood_pressure_obs = {}
-                    systolic = None
-                    diastolic = None
-                    for rec in correlation.iter("Record"):
-                        if rec.attrib["type"] == "HKQuantityTypeIdentifierBloodPressureSystolic":
-                            systolic = int(rec.attrib["value"])
-                        elif rec.attrib["type"] == "HKQuantityTypeIdentifierBloodPressureDiastolic":
-                            diastolic = int(rec.attrib["value"])
-                    if systolic is None or diastolic is None:
-                        if self.verbose:
-                            print("Missing both systolic and diastolic for blood pressure observation in XML data")
-                        continue
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    blood_pressure_obs["value"] = [systolic, diastolic]
-                    blood_pressure_obs["time"] = time
-                    blood_pressure_observations.append(blood_pressure_obs)
-                    blood_pressure_count += 1
-                    blood_pressure_sums[0] += systolic
-                    blood_pressure_sums[1] += diastolic
-                    if blood_pressure_max[0] is None:
-                        blood_pressure_max[0] = systolic
-                        blood_pressure_max[1] = diastolic
-                        blood_pressure_min[0] = systolic
-                        blood_pressure_min[1] = diastolic
-                    else:
-                        if blood_pressure_max[0] < systolic:
-                            blood_pressure_max[0] = systolic
-                        elif blood_pressure_min[0] > systolic:
-                            blood_pressure_min[0] = systolic
-                        if blood_pressure_max[1] < diastolic:
-                            blood_pressure_max[1] = diastolic
-                        elif blood_pressure_min[1] > diastolic:
-                            blood_pressure_min[1] = diastolic
-            for rec in root.iter("Record"):
-                if "type" not in rec.attrib:
-                    continue
-
-                rec_type = rec.attrib["type"]
-                obs = {}
-
-                if "value" in rec.attrib:
-                    try:
-                        value = float(rec.attrib["value"])
-                    except Exception:
-                        continue
-                    obs["value"] = value
-                else:
-                    continue
-                if "startDate" in rec.attrib:
-                    try:
-                        time = datetime.strptime(
-                            rec.attrib["startDate"], self.datetime_format)
-                    except Exception:
-                        if self.verbose:
-                            print("Exception on constructing date from XML observation")
-                    if self.start_year is not None and self.start_year > time.year:
-                        continue
-                else:
-                    continue
-
-                if rec_type == "HKQuantityTypeIdentifierHeight":
-                    if "unit" in rec.attrib:
-                        try:
-                            value = convert(self.normal_height_unit, HeightUnit.from_value(
-                                        rec.attrib["unit"]), value)
-                        except Exception as e:
-                            if self.verbose:
-                                print(e)
-                                print(rec.attrib["unit"])
-                            continue
-                    else:
-                        continue
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    set_stats(self.data.height_stats, time, value)
-                elif rec_type == "HKQuantityTypeIdentifierBodyMass":
-                    if "unit" in rec.attrib:
-                        try:
-                            value = convert(self.normal_weight_unit, WeightUnit.from_value(
-                                        rec.attrib["unit"]), value)
-                        except Exception as e:
-                            if self.verbose:
-                                print(e)
-                                print(rec.attrib["unit"])
-                            continue
-                    else:
-                        continue
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    set_stats(self.data.weight_stats, time, value)
-                elif rec_type == "HKQuantityTypeIdentifierHeartRate":
-                    metadataentry = rec.find("MetadataEntry")
-                    if (metadataentry is not None
-                            and "key" in metadataentry.attrib
-                            and metadataentry.attrib["key"] == "HKMetadataKeyHeartRateMotionContext"):
-                        obs["motion"] = int(metadataentry.attrib["value"])
-                        self.data.motion_data_found = True
-                    else:
-                        obs["motion"] = 0
-                    if value > 155:
-                        continue
-                    elif value > 140 and obs["motion"] != 0:
-                        continue
-                    elif value < 35:
-                        continue
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    obs["time"] = time
-                    heart_rate_observations.append(obs)
-                    heart_rate_count += 1
-                    heart_rate_sum += value
-                    heart_rate_most_recent = value
-                    if heart_rate_max is None:
-                        heart_rate_max = value
-                        heart_rate_min = value
-                    elif value > heart_rate_max:
-                        heart_rate_max = value
-                    elif value < heart_rate_min:
-                        heart_rate_min = value
-                elif rec_type == "HKQuantityTypeIdentifierHeartRateVariabilitySDNN":
-                    if value > 160:
-                        continue
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    set_stats(self.data.hrv_stats, time, value)
-                elif rec_type == "HKQuantityTypeIdentifierOxygenSaturation":
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    set_stats(self.data.spo2_stats, time, value)
-                elif rec_type == "HKQuantityTypeIdentifierAppleStandTime":
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    set_stats(self.data.stand_stats, time, value)
-                elif rec_type == "HKQuantityTypeIdentifierStepCount":
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    set_stats(self.data.step_stats, time, value)
-                elif rec_type == "HKQuantityTypeIdentifierBodyTemperature":
-                    if "unit" in rec.attrib:
-                        try:
-                            value = TemperatureUnit.from_value(
-                                rec.attrib["unit"]).convertTo(
-                                    self.normal_temperature_unit, value)
-                        except Exception as e:
-                            if self.verbose:
-                                print(e)
-                                print(rec.attrib["unit"])
-                            continue
-                    else:
-                        try:
-                            value = TemperatureUnit.from_value(
-                                "F" if value > 45 else "C").convertTo(
-                                    self.normal_temperature_unit, value)
-                        except Exception as e:
-                            if self.verbose:
-                                print(e)
-                            continue
-                    if time.toordinal() < AppleHealthXMLParser.min_xml_ordinal:
-                        AppleHealthXMLParser.min_xml_ordinal = time.toordinal()
-                    set_stats(self.data.temperature_stats, time, value)
-
-            self.data.blood_pressure_stats["count"] = blood_pressure_count
-            self.data.blood_pressure_stats["list"] = blood_pressure_observations
-            self.data.blood_pressure_stats["max"] = blood_pressure_max
-            self.data.blood_pressure_stats["min"] = blood_pressure_min
-            self.data.pulse_stats["count"] = heart_rate_count
-            self.data.pulse_stats["list"] = heart_rate_observations
-            self.data.pulse_stats["max"] = heart_rate_max
-            self.data.pulse_stats["min"] = heart_rate_min
-            self.data.set_observations_count(blood_pressure_count, heart_rate_count)
-            self.data.finalize(self.verbose,
-                blood_pressure_observations, blood_pressure_count, blood_pressure_sums,
-                heart_rate_observations, heart_rate_count, heart_rate_sum)
-
+            self.reset_parse_state()
+            if export_zip is not None:
+                if self.workers > 1 and self.verbose:
+                    print("Parsing export.xml from zip in a single pass - "
+                          + "extract the export to parse with multiple workers")
+                with export_zip.open_export_xml() as f:
+                    self.parse_stream(f)
+            elif self.workers > 1:
+                self.parse_parallel(export_xml_file_path)
+            elif self.record_type_filter is not None:
+                self.parse_chunk(export_xml_file_path, 0, os.path.getsize(export_xml_file_path))
+            else:
+                self.parse_events(ET.iterparse(export_xml_file_path, events=("start", "end")))
+            self.set_final_stats()
         except Exception as e:
             print("An exception occurred in parsing XML export files.")
             if self.verbose:
                 print(e)
             else:
                 print("For more detail on the error run in verbose mode.")
-            exit(1)
\ No newline at end of file
+            exit(1)
+
+    def reset_parse_state(self):
+        self.root = None
+        self.depth = 0
+
+    def set_final_stats(self):
+        self.data.set_observations_count()
+        self.data.finalize(self.verbose)
+
+    def parse_events(self, events):
+        correlation_handlers = self.handlers["Correlation"]
+        record_handlers = self.handlers["Record"]
+
+        # Stream the file instead of building the full tree - each top level
+        # element is cleared from the root once it has been consumed, so memory
+        # is bounded by the collected stats rather than the size of the export.
+        for event, elem in events:
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+                self.depth += 1
+                continue
+            self.depth -= 1
+            if elem.tag == "Record":
+                handler = record_handlers.get(elem.get("type"))
+                if handler is not None:
+                    self.parse_record(elem, handler)
+            elif elem.tag == "Correlation":
+                handler = correlation_handlers.get(elem.get("type"))
+                if handler is not None:
+                    handler(elem)
+            elif elem.tag == "Me":
+                self.parse_me(elem.attrib)
+            if self.depth == 1:
+                self.root.clear()
+
+    def parse_chunk(self, export_xml_file_path, start, end):
+        file_size = os.path.getsize(export_xml_file_path)
+        pull_parser = ET.XMLPullParser(events=("start", "end"))
+        # Chunks after the first begin on a top level element, so wrap them
+        # in a root element to make each one a well-formed document.
+        if start > 0:
+            pull_parser.feed(b"<HealthData>")
+        if self.record_type_filter is not None:
+            blocks = self.record_type_filter.iter_blocks(
+                export_xml_file_path, start, end, XML_READ_BLOCK_SIZE)
+        else:
+            blocks = iter_file_blocks(export_xml_file_path, start, end)
+        for block in blocks:
+            pull_parser.feed(block)
+            self.parse_events(pull_parser.read_events())
+        if end < file_size:
+            pull_parser.feed(b"</HealthData>")
+        pull_parser.close()
+        self.parse_events(pull_parser.read_events())
+
+    def parse_stream(self, f):
+        if self.record_type_filter is None:
+            self.parse_events(ET.iterparse(f, events=("start", "end")))
+            return
+        pull_parser = ET.XMLPullParser(events=("start", "end"))
+        for block in self.record_type_filter.iter_stream_blocks(f, XML_READ_BLOCK_SIZE):
+            pull_parser.feed(block)
+            self.parse_events(pull_parser.read_events())
+        pull_parser.close()
+        self.parse_events(pull_parser.read_events())
+
+    def parse_parallel(self, export_xml_file_path):
+        chunk_ranges = get_xml_chunk_ranges(export_xml_file_path,
+                                            self.workers * XML_CHUNKS_PER_WORKER)
+        if self.verbose:
+            print(f"Parsing XML in {len(chunk_ranges)} chunks with {self.workers} workers")
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(parse_xml_chunk, self.args, export_xml_file_path, start, end)
+                       for start, end in chunk_ranges]
+            # Merge in file order so the result matches a sequential parse
+            for future in futures:
+                chunk_data, subject = future.result()
+                self.data.merge(chunk_data)
+                self.subject.update(subject)
+
+    def parse_me(self, me):
+        birth_date_str = me["HKCharacteristicTypeIdentifierDateOfBirth"]
+        self.data.birth_date = birth_date_str
+        if "birthDate" not in self.subject:
+            birth_date = datetime.fromisoformat(birth_date_str)
+            self.subject["birthDate"] = birth_date_str
+            self.subject["age"] = get_age(birth_date)
+        self.subject["sex"] = me["HKCharacteristicTypeIdentifierBiologicalSex"].replace(
+            "HKBiologicalSex", "")
+        self.subject["bloodType"] = me["HKCharacteristicTypeIdentifierBloodType"].replace(
+            "HKBloodType", "")
+
+    def parse_time(self, elem):
+        # (year, UTC epoch seconds, UTC offset seconds) of the start date
+        try:
+            return self.timestamp_parser.parse_epoch(elem.attrib["startDate"])
+        except Exception:
+            if self.verbose:
+                print("Exception on constructing date from XML observation")
+            return None
+
+    def parse_record(self, rec, handler):
+        if "value" in rec.attrib:
+            try:
+                value = float(rec.attrib["value"])
+            except Exception:
+                return
+        else:
+            return
+        if "startDate" in rec.attrib:
+            timestamp = self.parse_time(rec)
+            if timestamp is None:
+                return
+            year, epoch, offset = timestamp
+            if self.start_year is not None and self.start_year > year:
+                return
+        else:
+            return
+        handler(rec, epoch, offset, value)
+
+    def set_min_ordinal(self, epoch, offset):
+        ordinal = get_local_ordinal(epoch, offset)
+        if ordinal < self.data.min_xml_ordinal:
+            self.data.min_xml_ordinal = ordinal
+
+    def handle_blood_pressure(self, correlation):
+        if "startDate" not in correlation.attrib:
+            return
+        timestamp = self.parse_time(correlation)
+        if timestamp is None:
+            return
+        year, epoch, offset = timestamp
+        if self.start_year is not None and self.start_year > year:
+            return
+
+        systolic = None
+        diastolic = None
+        for rec in correlation.iter("Record"):
+            if rec.attrib["type"] == "HKQuantityTypeIdentifierBloodPressureSystolic":
+                systolic = int(rec.attrib["value"])
+            elif rec.attrib["type"] == "HKQuantityTypeIdentifierBloodPressureDiastolic":
+                diastolic = int(rec.attrib["value"])
+        if systolic is None or diastolic is None:
+            if self.verbose:
+                print("Missing both systolic and diastolic for blood pressure observation in XML data")
+            return
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.blood_pressure_stats, epoch, offset, [systolic, diastolic])
+
+    def handle_height(self, rec, epoch, offset, value):
+        if "unit" in rec.attrib:
+            try:
+                value = convert(self.normal_height_unit, HeightUnit.from_value(
+                            rec.attrib["unit"]), value)
+            except Exception as e:
+                if self.verbose:
+                    print(e)
+                    print(rec.attrib["unit"])
+                return
+        else:
+            return
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.height_stats, epoch, offset, value)
+
+    def handle_body_mass(self, rec, epoch, offset, value):
+        if "unit" in rec.attrib:
+            try:
+                value = convert(self.normal_weight_unit, WeightUnit.from_value(
+                            rec.attrib["unit"]), value)
+            except Exception as e:
+                if self.verbose:
+                    print(e)
+                    print(rec.attrib["unit"])
+                return
+        else:
+            return
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.weight_stats, epoch, offset, value)
+
+    def handle_heart_rate(self, rec, epoch, offset, value):
+        metadataentry = rec.find("MetadataEntry")
+        if (metadataentry is not None
+                and "key" in metadataentry.attrib
+                and metadataentry.attrib["key"] == "HKMetadataKeyHeartRateMotionContext"):
+            motion = int(metadataentry.attrib["value"])
+            self.data.motion_data_found = True
+        else:
+            motion = 0
+        if value > 155:
+            return
+        elif value > 140 and motion != 0:
+            return
+        elif value < 35:
+            return
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.pulse_stats, epoch, offset, value, motion)
+
+    def handle_hrv(self, rec, epoch, offset, value):
+        if value > 160:
+            return
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.hrv_stats, epoch, offset, value)
+
+    def handle_spo2(self, rec, epoch, offset, value):
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.spo2_stats, epoch, offset, value)
+
+    def handle_stand(self, rec, epoch, offset, value):
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.stand_stats, epoch, offset, value)
+
+    def handle_steps(self, rec, epoch, offset, value):
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.step_stats, epoch, offset, value)
+
+    def handle_temperature(self, rec, epoch, offset, value):
+        if "unit" in rec.attrib:
+            try:
+                value = TemperatureUnit.from_value(
+                    rec.attrib["unit"]).convertTo(
+                        self.normal_temperature_unit, value)
+            except Exception as e:
+                if self.verbose:
+                    print(e)
+                    print(rec.attrib["unit"])
+                return
+        else:
+            try:
+                value = TemperatureUnit.from_value(
+                    "F" if value > 45 else "C").convertTo(
+                        self.normal_temperature_unit, value)
+            except Exception as e:
+                if self.verbose:
+                    print(e)
+                return
+        self.set_min_ordinal(epoch, offset)
+        set_stats(self.data.temperature_stats, epoch, offset, value)
+
+
+def iter_file_blocks(export_xml_file_path, start, end):
+    with open(export_xml_file_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(remaining, XML_READ_BLOCK_SIZE))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def find_xml_chunk_boundary(f, position):
+    # Find the start of the first top level Record or Correlation at or after position
+    f.seek(position)
+    window = b""
+    while True:
+        block = f.read(XML_READ_BLOCK_SIZE)
+        if not block:
+            return None
+        search_start = max(0, len(window) - len(XML_CHUNK_BOUNDARY_MARKERS[1]))
+        window += block
+        indices = [window.find(marker, search_start) for marker in XML_CHUNK_BOUNDARY_MARKERS]
+        indices = [index for index in indices if index >= 0]
+        if len(indices) > 0:
+            # Boundary falls just after the newline
+            return position + min(indices) + 1
+
+
+def get_xml_chunk_ranges(export_xml_file_path, chunk_count):
+    file_size = os.path.getsize(export_xml_file_path)
+    boundaries = [0]
+    with open(export_xml_file_path, "rb") as f:
+        for i in range(1, chunk_count):
+            boundary = find_xml_chunk_boundary(f, file_size * i // chunk_count)
+            if boundary is None:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_xml_chunk(args, export_xml_file_path, start, end):
+    # Runs in a worker process - returns partial stats to be merged by the caller
+    data = AppleHealthXMLData(args.normal_height_unit, args.normal_weight_unit, args.aggregates_only)
+    parser = AppleHealthXMLParser(data, args)
+    parser.reset_parse_state()
+    parser.parse_chunk(export_xml_file_path, start, end)
+    return data, parser.subject
@@ -0,0 +1,99 @@
+import mmap
+import re
+
+# Apple writes direct children of HealthData with a single space of indentation,
+# while records nested inside a Correlation are indented further. The type
+# attribute is always written first on Record elements.
+TOP_LEVEL_ELEMENT_PATTERN = re.compile(rb'\n <(/?)(\w+)(?: type="([^"]*)")?')
+KEPT_ELEMENT_TAGS = {b"Correlation", b"Me"}
+TOP_LEVEL_ELEMENT_MARKER = b"\n <"
+
+
+def find_last_element_start(buffer):
+    # Position of the newline before the last top level opening tag, or -1
+    position = buffer.rfind(TOP_LEVEL_ELEMENT_MARKER)
+    while position >= 0 and buffer[position + 3:position + 4] in (b"/", b"!", b""):
+        position = buffer.rfind(TOP_LEVEL_ELEMENT_MARKER, 0, position)
+    return position
+
+
+class XMLRecordTypeFilter:
+    '''
+    Scans the raw bytes of export.xml for top level elements and passes on
+    only the byte ranges the XML parser needs: the document header, the Me
+    element, every Correlation and any Record whose type has a registered
+    handler. Most of a typical export is record types that are never used
+    (active energy, distance, audio exposure etc.), so dropping them before
+    they reach the XML parser is the cheapest way to speed up parsing.
+    '''
+    def __init__(self, record_types):
+        self.record_types = set(record_type.encode("utf-8") for record_type in record_types)
+
+    def iter_ranges(self, mm, start, end):
+        # Yields (start, end) byte ranges to keep, adjacent kept elements coalesced
+        scan_start = max(start - 1, 0)
+        if start == 0:
+            # Leave the XML declaration and DTD untouched
+            root_start = mm.find(b"<HealthData", 0, end)
+            if root_start >= 0:
+                scan_start = root_start
+        keep = True
+        run_start = start
+        element_start = None
+        for match in TOP_LEVEL_ELEMENT_PATTERN.finditer(mm, scan_start, end):
+            element_start = match.start() + 1
+            closing, tag, record_type = match.groups()
+            if closing:
+                # Closing tag of an element with children - belongs with that element
+                continue
+            elif tag == b"Record":
+                # Leave records without a leading type attribute to the XML parser
+                keep_element = record_type is None or record_type in self.record_types
+            else:
+                # Correlations are always kept as they may hold nested records of any type
+                keep_element = tag in KEPT_ELEMENT_TAGS
+            if keep_element != keep:
+                if keep and element_start > run_start:
+                    yield run_start, element_start
+                run_start = element_start
+                keep = keep_element
+        if keep:
+            yield run_start, end
+        elif element_start is not None:
+            # The last element was dropped but the document closing tag must remain
+            trailer_start = mm.rfind(b"</HealthData>", element_start, end)
+            if trailer_start >= 0:
+                yield trailer_start, end
+
+    def iter_blocks(self, export_xml_file_path, start, end, block_size):
+        with open(export_xml_file_path, "rb") as f:
+            if end <= start:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for range_start, range_end in self.iter_ranges(mm, start, end):
+                    for block_start in range(range_start, range_end, block_size):
+                        yield mm[block_start:min(block_start + block_size, range_end)]
+
+    def iter_stream_blocks(self, f, block_size):
+        # For streams that cannot be mapped, such as export.xml read from a zip.
+        # Each window read is cut before its last top level opening tag so no
+        # element is split across windows, and the rest is carried forward.
+        window_start = 0
+        pending = b""
+        while True:
+            block = f.read(block_size)
+            window = pending + block
+            if block:
+                window_end = find_last_element_start(window)
+                if window_end <= 0:
+                    pending = window
+                    continue
+            else:
+                window_end = len(window)
+            pending = window[window_end:]
+            for range_start, range_end in self.iter_ranges(window, window_start, window_end):
+                yield window[range_start:range_end]
+            if not block:
+                return
+            # Later windows begin with the newline before a top level element
+            window_start = 1
@@ -1,13 +1,13 @@
 import csv
 import datetime
 from glob import glob
-import json
 import os
 import sys
 import traceback
 import uuid
 
-from data.labtest import LabTest
+from data import json_backend
+from data.labtest import LabTest, LabTestRegistry
 from data.observation import Observation
 from data.result import get_interpretation_keys, get_interpretation_text
 
@@ -124,13 +124,13 @@ def construct_observation(_id, subject, date, code_description, loinc_code, _ran
 def save_reports_to_json(reports, base_dir, verbose):
     has_saved_report = False
     has_error_in_report = False
-    tests = []
+    tests = LabTestRegistry()
     date_codes = {}
 
     # If file is already saved for this report, delete the previous version
     for _file in glob(os.path.join(base_dir, "*-CUSTOM.json")):
         try:
-            file_data = json.load(open(_file))
+            file_data = json_backend.load(_file)
             if "id" in file_data and file_data["id"] in reports:
                 print(
                     "WARNING: Removing previous version of custom DiagnosticReport: " + _file)
@@ -146,14 +146,13 @@ def save_reports_to_json(reports, base_dir, verbose):
             _uuid = str(uuid.uuid4())
             report_filename = "DiagnosticReport-" + _uuid + "-CUSTOM.json"
             report_path = os.path.join(base_dir, report_filename)
-            with open(report_path, 'w', encoding='utf-8') as f:
-                json.dump(report, f, ensure_ascii=False, indent=2)
-                if verbose:
-                    ("Saved file: " + report_path)
+            json_backend.dump(report, report_path, indent=2)
+            if verbose:
+                ("Saved file: " + report_path)
             has_saved_report = True
 
             # Validate contained observations
-            file_data = json.load(open(report_path))
+            file_data = json_backend.load(report_path)
             data_category = file_data["category"]["coding"][0]["code"]
             i = 0
             for observation in file_data["contained"]:
@@ -2,8 +2,10 @@ from datetime import datetime
 import getopt
 import os
 import sys
+import zipfile
 
 from data.data_parser import DataParser
+from data.export_zip import AppleHealthExportZip
 from data.units import HeightUnit, WeightUnit, TemperatureUnit, get_age
 
 class HealthDataParseArgs:
@@ -12,6 +14,12 @@ class HealthDataParseArgs:
             print("Missing Apple Health data export directory path.")
             print(help_text)
             exit(1)
+
+        self.export_zip = None
+        if os.path.isfile(data_export_dir) and zipfile.is_zipfile(data_export_dir):
+            # Read the export in place and write output files next to the zip
+            self.export_zip = data_export_dir
+            data_export_dir = os.path.dirname(os.path.abspath(data_export_dir))
         elif not os.path.exists(data_export_dir) or not os.path.isdir(data_export_dir):
             print(f"Apple Health data export directory path \"{data_export_dir}\" is invalid.")
             print(help_text)
@@ -35,6 +43,15 @@ class HealthDataParseArgs:
         self.food_data_csv = None
         self.symptom_data_csv = None
         self.json_add_all_vitals = False
+        self.aggregates_only = False
+        self.workers = 1
+        self.xml_prefilter = True
+        self.xml_cache = True
+        self.clinical_records_cache = True
+        self.json_streaming = True
+        self.parse_snapshot = True
+        self.reclassify = False
+        self.observation_store = False
         self.subject = {}
         self.normal_height_unit = HeightUnit.CM
         self.normal_weight_unit = WeightUnit.LB
@@ -49,7 +66,20 @@ class HealthDataParseArgs:
         self.export_cda_xml = os.path.join(self.data_export_dir, "export_cda.xml")
         self.base_dir = os.path.join(self.data_export_dir, "clinical-records")
 
-        if not os.path.exists(self.base_dir) or len(os.listdir(self.base_dir)) == 0:
+        if self.export_zip is not None:
+            try:
+                export_zip = AppleHealthExportZip(self.export_zip)
+                has_clinical_records = export_zip.has_clinical_records()
+                export_zip.close()
+            except Exception as e:
+                print(f"Failed to read Apple Health export zip \"{self.export_zip}\": {e}")
+                exit(1)
+            if not has_clinical_records:
+                print("Folder \"clinical-records\" not found in export zip \""
+                    + self.export_zip + "\".")
+                print("Ensure data has been connected to Apple Health before export.")
+                exit(1)
+        elif not os.path.exists(self.base_dir) or len(os.listdir(self.base_dir)) == 0:
             print("Folder \"clinical-records\" not found in export folder \""
                 + data_export_dir + "\".")
             print("Ensure data has been connected to Apple Health before export.")
@@ -60,6 +90,7 @@ help_text = """
 Usage:
 
    $ python parse_data.py path/to/apple_health_export ${args}
+   $ python parse_data.py path/to/export.zip ${args}
 
     --only_clinical_records
         Do not attempt to parse default XML export files (much faster)
@@ -107,6 +138,60 @@ Usage:
         If using a wearable, many vital sign observations may be accumulated.
         By default these are not added to the JSON output - pass to add these.
 
+    --aggregates_only
+        Keep only running statistics by day and minute for vital signs instead
+        of every observation, so memory use stays flat for large wearable
+        exports. Can't be combined with --json_add_all_vitals.
+
+    --disable_xml_cache
+        By default vitals parsed from export.xml are cached in the export
+        directory and reused while the export and parse options are unchanged.
+        Pass this flag to always parse export.xml and skip writing the cache.
+
+    --disable_xml_prefilter
+        By default record types in export.xml that are not used in the output
+        are skipped before XML parsing. Pass this flag to parse every record.
+
+    --disable_clinical_records_cache
+        By default the clinical-records files read are listed with their size,
+        modification time and content hash in a manifest in the export
+        directory along with the data read from them, and later runs only read
+        files whose size or modification time changed and only decode new or
+        changed files.
+        Pass this flag to decode every file and skip writing the manifest.
+
+    --disable_json_streaming
+        By default clinical-records DiagnosticReport files of 8 MB or more are
+        read one contained observation at a time if ijson is installed, so a
+        large report never needs to be held in memory whole. Pass this flag to
+        decode them whole like other files.
+
+    --disable_parse_snapshot
+        By default the parsed clinical records results are saved to
+        parse_snapshot.json in the export directory for --reclassify. Pass
+        this flag to skip writing it.
+
+    --workers=[int]
+        Parse export.xml in chunks and decode clinical-records files across
+        this many processes. Defaults to 1, which parses export.xml in a single
+        streaming pass and reads clinical-records files one at a time.
+
+    --reclassify
+        Each run saves the parsed clinical records results to
+        parse_snapshot.json in the export directory. Pass this flag to apply
+        different abnormal result options, such as --in_range_abnormal_boundary
+        or --filter_abnormal_in_range, to those results and rewrite the
+        reports without parsing the export again. Vitals are read from the
+        export.xml cache. Options applied while parsing, like --start_year,
+        must be unchanged.
+
+    --observation_store
+        Save the results parsed to observations.db, an SQLite database in the
+        export directory, updating results saved there by earlier runs, and
+        report on every result saved. Results from earlier exports are kept
+        even if missing from later ones. Vital signs are not saved and are
+        reported from the current export.
+
     --custom_only
         Skip parsing of Apple Health export data and only create a report from
         the custom files provided in the arguments.
@@ -134,6 +219,7 @@ if __name__ == "__main__":
 
     try:
         opts, args = getopt.getopt(COMMANDS, ":hv", [
+                "aggregates_only",
                 "filter_abnormal_in_range",
                 "help",
                 "json_add_all_vitals",
@@ -141,6 +227,13 @@ if __name__ == "__main__":
                 "skip_long_values",
                 "verbose",
                 "custom_only",
+                "disable_clinical_records_cache",
+                "disable_json_streaming",
+                "disable_parse_snapshot",
+                "disable_xml_cache",
+                "disable_xml_prefilter",
+                "observation_store",
+                "reclassify",
                 "birth_date=",
                 "extra_observations=",
                 "food_data=",
@@ -149,6 +242,7 @@ if __name__ == "__main__":
                 "start_year=",
                 "skip_dates=",
                 "symptom_data=",
+                "workers=",
                 ])
     except getopt.GetoptError as err:
         # print help information and exit:
@@ -166,6 +260,11 @@ if __name__ == "__main__":
         elif o == "--json_add_all_vitals":
             parse_args.json_add_all_vitals = True
             print("Including all vital data in JSON output")
+        elif o == "--aggregates_only":
+            parse_args.aggregates_only = True
+            print("Keeping only aggregate statistics for vital signs")
+            print("WARNING: Pulse spike counts with --aggregates_only assume export.xml lists "
+                  + "heart rate readings in time order")
         elif o == "--filter_abnormal_in_range":
             parse_args.skip_in_range_abnormal_results = True
             print("Excluding abnormal results within allowed quantitative ranges")
@@ -222,11 +321,55 @@ if __name__ == "__main__":
                 exit(1)
         elif o == "--symptom_data":
             parse_args.symptom_data_csv = a
+        elif o == "--workers":
+            try:
+                parse_args.workers = int(a)
+                if parse_args.workers < 1:
+                    raise ValueError("Workers must be at least 1")
+                print(f"Parsing XML with {a} workers")
+            except Exception:
+                print(f"\"{a}\" is not a valid number of workers.")
+                exit(1)
+        elif o == "--disable_xml_cache":
+            parse_args.xml_cache = False
+        elif o == "--disable_xml_prefilter":
+            parse_args.xml_prefilter = False
+        elif o == "--disable_clinical_records_cache":
+            parse_args.clinical_records_cache = False
+        elif o == "--disable_json_streaming":
+            parse_args.json_streaming = False
+        elif o == "--disable_parse_snapshot":
+            parse_args.parse_snapshot = False
+        elif o == "--observation_store":
+            parse_args.observation_store = True
+        elif o == "--reclassify":
+            parse_args.reclassify = True
+            print("Reclassifying results from the last parsed data")
         elif o == "--custom_only":
             parse_args.custom_only = True
         else:
             assert False, "unhandled option"
 
+    if parse_args.aggregates_only and parse_args.json_add_all_vitals:
+        print("--aggregates_only does not keep the vital sign observations required by --json_add_all_vitals.")
+        exit(1)
+
+    if parse_args.reclassify and parse_args.custom_only:
+        print("--reclassify and --custom_only can't be combined.")
+        exit(1)
+
+    if parse_args.reclassify and not parse_args.parse_snapshot:
+        print("--reclassify reads the saved parse snapshot and can't be combined with --disable_parse_snapshot.")
+        exit(1)
+
+    if parse_args.reclassify and not parse_args.xml_cache:
+        print("--reclassify reads vitals from the export.xml cache and can't be combined with --disable_xml_cache.")
+        exit(1)
+
+    if parse_args.reclassify and parse_args.extra_observations_csv is not None:
+        print("--extra_observations requires parsing clinical records again, run without --reclassify.")
+        exit(1)
+
     parser = DataParser(parse_args)
     if parse_args.custom_only:
         parser.create_custom_report()
@@ -4,20 +4,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 
-from data.units import base_stats
-
-
-def set_stats(stats: dict, value):
-    stats["list"].append(value)
-    stats["count"] += 1
-    stats["sum"] += value
-    if stats["max"] is None:
-        stats["max"] = value
-        stats["min"] = value
-    elif stats["max"] < value:
-        stats["max"] = value
-    elif stats["min"] > value:
-        stats["min"] = value
+from data.units import base_stats, get_stdev
+from data.vital_aggregates import VitalAggregates, group_stats
 
 
 def smooth(data, smoothing_factor: int, pad_with_zeros=False):
@@ -144,52 +132,47 @@ class VitalsStatsGraph:
     # For each day in the series, split it into minute increments and
     # calculate the average pulse during this minute
     def collect_minute_pulse_stats(self, pulse_stats, hrv_stats):
-        day_minute_readings = {}
-        day_minute_motion_readings = {}
-        instances_of_heart_rate_spike = {}
-        self.minutes = []
-
-        for i in range(60 * 24):
-            self.minutes.append(i)
-            day_minute_readings[i] = deepcopy(base_stats)
-            day_minute_motion_readings[i] = deepcopy(base_stats)
-            instances_of_heart_rate_spike[i] = 0
-
-        save_minute = -1
-        save_value = 0
-        self.values_in_motion = []
-        self.values_resting = []
+        self.minutes = list(range(60 * 24))
         self.max_in_motion = None
         self.min_in_motion = None
         self.max_resting = None
         self.min_resting = None
 
-        for obs in pulse_stats["list"]:
-            minute = obs["time"].hour * 60 + obs["time"].minute
-            value = obs["value"]
-            motion = obs["motion"]
-            set_stats(day_minute_readings[minute], value)
-            set_stats(day_minute_motion_readings[minute], motion)
-
-            if motion > 0 or value > 105:
-                self.values_in_motion.append(value)
-            else:
-                self.values_resting.append(value)
-
-            if (minute - save_minute < 5
-                    and value - save_value > 40
-                    and save_minute > -1):
-                instances_of_heart_rate_spike[save_minute] += 1
-
-            save_minute = minute
-            save_value = value
+        pulse_series = pulse_stats["list"]
+        if isinstance(pulse_series, VitalAggregates):
+            day_minute_readings = dict(pulse_series.minutes)
+            day_minute_motion_readings = dict(pulse_series.motion_minutes)
+            instances_of_heart_rate_spike = pulse_series.spikes
+            self.count_in_motion = pulse_series.in_motion["count"]
+            self.count_resting = pulse_series.resting["count"]
+            self.avg_in_motion = pulse_series.in_motion["avg"] if self.count_in_motion > 0 else np.nan
+            self.avg_resting = pulse_series.resting["avg"] if self.count_resting > 0 else np.nan
+        else:
+            minutes = pulse_series.get_local_minutes()
+            values = pulse_series.get_values()
+            motion = pulse_series.get_motion()
+            day_minute_readings = group_stats(minutes, values)
+            day_minute_motion_readings = group_stats(minutes, motion.astype(np.float64))
+
+            in_motion = (motion > 0) | (values > 105)
+            values_in_motion = values[in_motion]
+            values_resting = values[~in_motion]
+
+            # A spike is a rise of over 40 BPM from the previous reading within 5 minutes
+            instances_of_heart_rate_spike = np.zeros(len(self.minutes), dtype=np.int64)
+            if len(minutes) > 1:
+                spikes = (minutes[1:] - minutes[:-1] < 5) & (values[1:] - values[:-1] > 40)
+                np.add.at(instances_of_heart_rate_spike, minutes[:-1][spikes], 1)
+
+            self.count_in_motion = len(values_in_motion)
+            self.count_resting = len(values_resting)
+            self.avg_in_motion = np.average(values_in_motion)
+            self.avg_resting = np.average(values_resting)
+        for minute in self.minutes:
+            if minute not in day_minute_readings:
+                day_minute_readings[minute] = deepcopy(base_stats)
+                day_minute_motion_readings[minute] = deepcopy(base_stats)
 
-        self.values_in_motion.sort()
-        self.values_resting.sort()
-        self.values_in_motion = np.array(self.values_in_motion)
-        self.values_resting = np.array(self.values_resting)
-        self.avg_in_motion = np.average(self.values_in_motion)
-        self.avg_resting = np.average(self.values_resting)
         self.minutes = np.array(self.minutes)
         self.minute_max = []
         self.minute_min = []
@@ -214,25 +197,33 @@ class VitalsStatsGraph:
                                         self.motion_min)
             # self.set_final_minute_stats(minute, day_minute_hrv_readings,
             #                             self.hrv_avgs, self.hrv_stdevs)
-            self.spikeCounts.append(instances_of_heart_rate_spike[minute])
+            self.spikeCounts.append(int(instances_of_heart_rate_spike[minute]))
 
     def set_daily_stats(self, vital_stats, date_vital_stats, dates_list):
-        for obs in vital_stats["list"]:
-            date = obs["time"].toordinal()
-            if date < self.min_xml_ordinal:
-                continue
-            elif date not in dates_list:
-                dates_list.append(date)
-            if self.min_ordinal > date:
-                self.min_ordinal = date
-            if self.max_ordinal < date:
-                self.max_ordinal = date
-            if date in date_vital_stats:
-                date_stats = date_vital_stats[date]
-            else:
-                date_stats = deepcopy(base_stats)
-            set_stats(date_stats, obs["value"])
-            date_vital_stats[date] = date_stats
+        vital_series = vital_stats["list"]
+        if isinstance(vital_series, VitalAggregates):
+            # Matches the order first seen in a sorted series
+            for date, date_stats in sorted(vital_series.days.items()):
+                if date >= self.min_xml_ordinal:
+                    dates_list.append(date)
+                    date_vital_stats[date] = date_stats
+            if len(dates_list) > 0:
+                self.min_ordinal = min(self.min_ordinal, min(dates_list))
+                self.max_ordinal = max(self.max_ordinal, max(dates_list))
+            return
+        dates = vital_series.get_local_ordinals()
+        values = vital_series.get_values()
+        in_range = dates >= self.min_xml_ordinal
+        dates = dates[in_range]
+        values = values[in_range]
+        if len(dates) == 0:
+            return
+        # Dates in the order first seen
+        _, first_indices = np.unique(dates, return_index=True)
+        dates_list.extend(dates[np.sort(first_indices)].tolist())
+        self.min_ordinal = min(self.min_ordinal, int(dates.min()))
+        self.max_ordinal = max(self.max_ordinal, int(dates.max()))
+        date_vital_stats.update(group_stats(dates, values))
 
     def set_final_date_stats(self, date, data, final_stats, keep_sums=False):
         count = data[date]["count"] if (date in data) else 0
@@ -248,17 +239,11 @@ class VitalsStatsGraph:
             date_stats = data[date]
             final_stats["max"].append(date_stats["max"])
             final_stats["min"].append(date_stats["min"])
-            avg = date_stats["sum"] / count
-            final_stats["avgs"].append(avg)
+            final_stats["avgs"].append(date_stats["avg"])
             if keep_sums:
-                final_stats["sums"].append(date_stats["sum"])
+                final_stats["sums"].append(date_stats["avg"] * count)
             else:
-                del date_stats["sum"]
-                sum_sq_diffs = 0
-                for value in date_stats["list"]:
-                    sum_sq_diffs += (value - avg) ** 2
-                final_stats["stdevs"].append(
-                    (sum_sq_diffs / count) ** (1/2))
+                final_stats["stdevs"].append(get_stdev(date_stats))
             del data[date]
 
     def set_final_minute_stats(self, minute, minute_readings, avgs, stdevs,
@@ -279,13 +264,8 @@ class VitalsStatsGraph:
                 maxs.append(minute_stats["max"])
             if mins is not None:
                 mins.append(minute_stats["min"])
-            avg = minute_stats["sum"] / count
-            avgs.append(avg)
-            del minute_stats["sum"]
-            sum_sq_diffs = 0
-            for value in minute_stats["list"]:
-                sum_sq_diffs += (value - avg) ** 2
-            stdevs.append((sum_sq_diffs / count) ** (1/2))
+            avgs.append(minute_stats["avg"])
+            stdevs.append(get_stdev(minute_stats))
 
     def save_graph_images(self, base_dir: str):
         self.save_loc_minutes_data = os.path.join(
@@ -212,7 +212,7 @@ class Report:
 
                 for vital in json_data["vitalSigns"]:
                     if vital["count"] > 0:
-                        most_recent_obs = vital["list"][-1]
+                        most_recent_obs = vital["mostRecent"]
                         if type(vital["mostRecent"]["value"]) == list:
                             for i in range(len(vital["mostRecent"]["value"])):
                                 row = [vital["labels"][i], vital["unit"]]
@@ -493,42 +493,32 @@ class Report:
         # abnormal_results_tables is a list of abnormal observation date
         # results with columsn of up to n_dates_in_table_per_page per page
         abnormal_results_tables = []
+        pivot = data.get_pivot()
 
-        for code in sorted(data.observation_code_ids):
+        for code in pivot.codes:
             date_counter = 0
             table_counter = 0
             table = abnormal_results_tables[table_counter] if len(
                 abnormal_results_tables) > table_counter else []
             row = []
             has_unappended_row = False
-            abnormal_result_found = False
+            abnormal_result_found = code in pivot.abnormal_results
+            abnormal_results = pivot.abnormal_results.get(code, {})
 
             for date in data.abnormal_result_dates:
                 date_counter += 1
-                date_found = False
                 has_unappended_row = True
 
-                for code_id in data.observation_code_ids[code]:
-                    if code_id in data.abnormal_results:
-                        abnormal_result_found = True
-                        results = data.abnormal_results[code_id]
-                        for observation in results:
-                            if observation.date == date and date + code_id in data.date_codes:
-                                date_found = True
-                                value = observation.value_string[:15]
-                                if observation.has_reference:
-                                    abnormal_result_tag = observation.result.interpretation
-                                else:
-                                    abnormal_result_tag = ""
-                                row.append(_wrap_text_to_fit_length(
-                                    value + abnormal_result_tag, 10))
-                                break
-                        else:
-                            continue
-
-                        break
-
-                if not date_found:
+                if date in abnormal_results:
+                    observation = abnormal_results[date]
+                    value = observation.value_string[:15]
+                    if observation.has_reference:
+                        abnormal_result_tag = observation.result.interpretation
+                    else:
+                        abnormal_result_tag = ""
+                    row.append(_wrap_text_to_fit_length(
+                        value + abnormal_result_tag, 10))
+                else:
                     row.append("")
 
                 if abnormal_result_found and date_counter % self.n_dates_in_table_per_page == 0:
@@ -665,35 +655,31 @@ class Report:
         # results_tables is a list of observation date results with columns
         # of up to n_dates_in_table_per_page per page
         results_tables = []
+        pivot = data.get_pivot()
 
-        for code in sorted(data.observation_code_ids):
+        for code in pivot.codes:
             date_counter = 0
             table_counter = 0
             table = results_tables[table_counter] if len(
                 results_tables) > table_counter else []
             row = []
             has_unappended_row = False
+            results = pivot.results[code]
 
             for date in data.observation_dates:
                 date_counter += 1
-                date_found = False
                 has_unappended_row = True
 
-                for code_id in data.observation_code_ids[code]:
-                    datecode = date + code_id
-                    if datecode in data.date_codes:
-                        date_found = True
-                        observation = data.observations[data.date_codes[datecode]]
-                        if observation.has_reference:
-                            abnormal_result_tag = observation.result.interpretation
-                        else:
-                            abnormal_result_tag = ""
-                        value = observation.value_string[:15]
-                        row.append(_wrap_text_to_fit_length(
-                            value + abnormal_result_tag, 10))
-                        break
-
-                if not date_found:
+                if date in results:
+                    observation = results[date]
+                    if observation.has_reference:
+                        abnormal_result_tag = observation.result.interpretation
+                    else:
+                        abnormal_result_tag = ""
+                    value = observation.value_string[:15]
+                    row.append(_wrap_text_to_fit_length(
+                        value + abnormal_result_tag, 10))
+                else:
                     row.append("")
 
                 if date_counter % self.n_dates_in_table_per_page == 0:
@@ -799,8 +785,8 @@ class Report:
                                                + str(round(vital["avg"], 1)), 45)
                 text3 = _right_pad_with_spaces("Pulse standard deviation: "
                                                + str(round(vital["stDev"], 1)), 45)
-                percent_in_motion = len(
-                    pulse_stats_graph.values_in_motion) / len(pulse_stats_graph.values_resting) * 100
+                percent_in_motion = (pulse_stats_graph.count_in_motion
+                                     / pulse_stats_graph.count_resting * 100)
                 creator.show_text(text1 + "Percent in motion: "
                                   + str(round(percent_in_motion)) + "%")
                 creator.show_text(text2 + "Average in motion: "
@@ -1,12 +1,13 @@
 from copy import deepcopy
 import csv
 from datetime import datetime
-import json
 import operator
 import os
 import traceback
 
+from data import json_backend
 from data.result import get_interpretation_keys, get_interpretation_text
+from data.vital_series import VitalSeries
 from reporting.report import Report
 
 
@@ -119,28 +120,20 @@ class Reporter:
                     for date in data.abnormal_result_dates:
                         header.append(date)
                     filewriter.writerow(header)
-                    for code in sorted(data.observation_code_ids):
+                    pivot = data.get_pivot()
+                    for code in pivot.codes:
+                        if code not in pivot.abnormal_results:
+                            continue
+                        abnormal_results = pivot.abnormal_results[code]
                         row = [code]
-                        abnormal_result_found = False
                         for date in data.abnormal_result_dates:
-                            date_found = False
-                            for code_id in data.observation_code_ids[code]:
-                                if code_id in data.abnormal_results:
-                                    abnormal_result_found = True
-                                    results = data.abnormal_results[code_id]
-                                    for observation in results:
-                                        if (observation.date == date and date + code_id in data.date_codes):
-                                            date_found = True
-                                            row.append(observation.value_string + " "
-                                                    + observation.result.interpretation)
-                                            break
-                                    else:
-                                        continue
-                                    break
-                            if not date_found:
+                            if date in abnormal_results:
+                                observation = abnormal_results[date]
+                                row.append(observation.value_string + " "
+                                        + observation.result.interpretation)
+                            else:
                                 row.append("")
-                        if abnormal_result_found:
-                            filewriter.writerow(row)
+                        filewriter.writerow(row)
                 print("Abnormal laboratory results data from Apple Health saved to " + filepath)
             except Exception as e:
                 print("An error occurred in writing abnormal results data to CSV.")
@@ -162,27 +155,24 @@ class Reporter:
                         header.append(date + " range")
                     header.append(date + " result")
                 filewriter.writerow(header)
-                for code in sorted(data.observation_code_ids):
+                pivot = data.get_pivot()
+                for code in pivot.codes:
                     row = [code]
+                    results = pivot.results[code]
                     for date in data.observation_dates:
-                        date_found = False
-                        for code_id in data.observation_code_ids[code]:
-                            datecode = date + code_id
-                            if datecode in data.date_codes:
-                                date_found = True
-                                observation = data.observations[data.date_codes[datecode]]
-                                if date in data.reference_dates:
-                                    if observation.has_reference:
-                                        row.append(" " + observation.result.range_text)
-                                        # Excel formats as date without space here
-                                    else:
-                                        row.append("")
-                                abnormal_result_tag = " " + \
-                                    observation.result.interpretation if observation.has_reference else ""
-                                row.append(observation.value_string
-                                        + abnormal_result_tag)
-                                break
-                        if not date_found:
+                        if date in results:
+                            observation = results[date]
+                            if date in data.reference_dates:
+                                if observation.has_reference:
+                                    row.append(" " + observation.result.range_text)
+                                    # Excel formats as date without space here
+                                else:
+                                    row.append("")
+                            abnormal_result_tag = " " + \
+                                observation.result.interpretation if observation.has_reference else ""
+                            row.append(observation.value_string
+                                    + abnormal_result_tag)
+                        else:
                             row.append("")
                             if date in data.reference_dates:
                                 row.append("")
@@ -244,15 +234,15 @@ class Reporter:
                 observations_list.reverse()
                 json_data["observations"] = observations_list
 
-            class DateTimeEncoder(json.JSONEncoder):
-                def default(self, z):
-                    if isinstance(z, datetime):
-                        return (datetime.strftime(z, args.datetime_format))
-                    else:
-                        return super().default(z)
+            def encode_datetime(z):
+                if isinstance(z, datetime):
+                    return (datetime.strftime(z, args.datetime_format))
+                elif isinstance(z, VitalSeries):
+                    return z.to_dict_list()
+                else:
+                    raise TypeError(f"Object of type {type(z).__name__} is not JSON serializable")
 
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(json_data, f, cls=DateTimeEncoder, ensure_ascii=False, indent=4)
+            json_backend.dump(json_data, filepath, default=encode_datetime, indent=4)
             print("Laboratory records data from Apple Health saved to " + filepath)
         except Exception as e:
             print("An error occurred in writing observations data to JSON.")
@@ -1,5 +1,4 @@
 from datetime import datetime
-import json
 import os
 
 import tkinter as tk
@@ -8,6 +7,9 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import pandas as pd
 
+from data import json_backend
+from data.observation_store import ObservationStore, OBSERVATION_STORE_FILENAME
+
 class StatisticsWindow:
     def __init__(self, parent, data_dir):
         self.window = tk.Toplevel(parent)
@@ -47,13 +49,24 @@ class StatisticsWindow:
             # Load JSON data
             json_path = os.path.join(self.data_dir, "observations.json")
             if os.path.exists(json_path):
-                with open(json_path, 'r') as f:
-                    self.json_data = json.load(f)
+                self.json_data = json_backend.load(json_path)
             else:
                 self.json_data = {}
                 
-            # Load CSV data
+            # Load results from the observation store if the last run saved to it
+            store_path = os.path.join(self.data_dir, OBSERVATION_STORE_FILENAME)
             csv_path = os.path.join(self.data_dir, "observations.csv")
+            if os.path.exists(store_path) and (not os.path.exists(csv_path)
+                    or os.path.getmtime(store_path) >= os.path.getmtime(csv_path)):
+                store = ObservationStore(store_path, read_only=True)
+                try:
+                    self.df = pd.DataFrame(store.get_observation_rows())
+                    self.abnormal_df = pd.DataFrame(store.get_observation_rows(abnormal_only=True))
+                finally:
+                    store.close()
+                return
+
+            # Load CSV data
             if os.path.exists(csv_path):
                 self.df = pd.read_csv(csv_path)
             else: